@@ -0,0 +1,160 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : archive.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : Module for my store of the raw outputs (XML/JSON) of the validators
+# NOTE           : each output is stored compressed in <dir>/<h[0:2]>/<h>.gz, h being the SHA1 of the validator URL.
+#                : The files are written under a temporary name then renamed, so several processes can share the store
+###########################################################################
+# HISTORY        :
+#                : Version 1.0
+#                :    - Created: 2026-10-17 to keep the outputs of the validators and reuse them during --cache-ttl
+###########################################################################
+
+
+import os
+import gzip
+import hashlib
+import threading
+import time
+import logging
+
+
+class Writer(object):
+    '''
+    file-like object reading a response and writing what is read to the store
+    '''
+
+    def __init__(self, source, path):
+        '''
+        :param source: httppool.Response to read
+        :param path: final path of the stored file
+        '''
+        self.source = source
+        self.path = path
+        self.tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+        self.file = gzip.GzipFile(self.tmp_path, "wb", 6)
+
+    def read(self, n=-1):
+        data = self.source.read(n)
+        self.file.write(data)
+        return data
+
+    def close(self):
+        '''
+        finish writing the file: the rest of the response is read first if the reader stopped before its end (ex: parse error).
+        The file is put in the store only if the response was read until its end, it is deleted if the reading was aborted
+        '''
+        try:
+            if(self.source.aborted==None):
+                while(self.read(65536)):
+                    pass
+        except Exception: # kept in source.aborted
+            pass
+        self.file.close()
+        if(self.source.eof and self.source.aborted==None):
+            os.rename(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+class ResponseStore(object):
+    '''
+    store of the outputs of the validators, indexed by the validator URL
+    '''
+
+    def __init__(self, path, ttl=0, max_size=0):
+        '''
+        :param path: directory of the store, created if needed
+        :param ttl: the stored outputs are used instead of calling the validator during ttl seconds (0 = never)
+        :param max_size: max nb of bytes of the store, the oldest files are removed by evict() (0 = no limit)
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        if(not os.path.isdir(path)):
+            os.makedirs(path)
+
+    def file_path(self, vurl):
+        '''
+        :return: path of the file for the validator URL
+        '''
+        h = hashlib.sha1(vurl).hexdigest()
+        return os.path.join(self.path, h[0:2], h+".gz")
+
+    def has(self, vurl):
+        '''
+        :return: True if an output is stored for the validator URL, whatever its age
+        '''
+        return os.path.isfile(self.file_path(vurl))
+
+    def get(self, vurl, ttl=None):
+        '''
+        :param vurl: validator URL
+        :param ttl: max age of the file (secs), default is the ttl of the store, 0 = no limit
+        :return: (file-like object to read the stored output, time it was stored) or None if it is not stored or too old
+        '''
+        if(ttl==None):
+            ttl = self.ttl
+            if(ttl<=0):
+                return None
+        path = self.file_path(vurl)
+        try:
+            mtime = os.path.getmtime(path)
+            if(ttl>0 and time.time()-mtime>ttl):
+                return None
+            return (gzip.GzipFile(path, "rb"), mtime)
+        except (IOError, OSError):
+            return None
+
+    def writer(self, vurl, source):
+        '''
+        :param vurl: validator URL
+        :param source: response of the validator
+        :return: Writer object to read the response with, it must be closed once read
+        '''
+        path = self.file_path(vurl)
+        d = os.path.dirname(path)
+        if(not os.path.isdir(d)):
+            try:
+                os.makedirs(d)
+            except OSError: # created by another worker
+                pass
+        return Writer(source, path)
+
+    def evict(self):
+        '''
+        remove the oldest files until the store is not bigger than max_size, and the temporary files left by killed workers
+        '''
+        files = []
+        total = 0
+        now = time.time()
+        for (d, subdirs, names) in os.walk(self.path):
+            for name in names:
+                path = os.path.join(d, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if(name.endswith(".tmp")):
+                    if(now-st.st_mtime>3600):
+                        os.remove(path)
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        nb_removed = 0
+        if(self.max_size>0 and total>self.max_size):
+            files.sort()
+            for (mtime, size, path) in files:
+                if(total<=self.max_size):
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                nb_removed += 1
+        logging.info("Response store %s: %d files, %d bytes, %d files removed", self.path, len(files)-nb_removed, total, nb_removed)
@@ -0,0 +1,202 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : bench-e2e.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : End-to-end benchmark of val.py against the stand-in validators of stubval.py
+# NOTE           : for each engine and nb of workers, a synthetic services table is created in a new SQLite DB (with
+#                : create_table_services of query-rr.py) and val.py is run on it with --validator-url and --stats
+###########################################################################
+# HISTORY        :
+#                : Version 1.0
+#                :    - Created: 2026-10-17 to measure val.py without calling the VO-Paris validators
+###########################################################################
+
+import sys
+import os
+import getopt
+import logging
+import subprocess
+import tempfile
+import datetime
+import json
+import imp
+import db # my db module
+import stubval # my stand-in validators
+
+
+# directory of the scripts
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# query-rr.py can not be imported with import because of its name
+query_rr = imp.load_source("query_rr", os.path.join(script_dir, "query-rr.py"))
+
+
+# specs of the synthetic services with their version
+specs = [
+     ("Simple Cone Search", "1.03")
+    ,("Simple Image Access", "1.0")
+    ,("Simple Spectral Access", "1.1")
+    ,("Table Access Protocol", "1.0")
+]
+
+
+def seed_services(db_file, nb_services, nb_hosts=50, shared=0.1):
+    '''
+    create the services and errors tables in a new DB and insert synthetic services, all to validate today
+    :param db_file: name of the sqlite3 DB file, removed first if it exists
+    :param nb_services: nb of services
+    :param nb_hosts: nb of hosts of the services
+    :param shared: fraction of the services with the same URL as the previous one (ex: VizieR TAP services)
+    '''
+    if(os.path.exists(db_file)):
+        os.remove(db_file)
+    conn = db.open_db(db_file)
+    query_rr.create_table_services(conn)
+    query_rr.create_table_errors(conn)
+    db.migrate(conn)
+
+    today_s = datetime.date.today().strftime('%Y-%m-%d')
+    rows = []
+    every = int(round(1/shared)) if shared>0 else 0
+    for i in range(nb_services):
+        (spec, specv) = specs[i%len(specs)]
+        if(every>0 and i>=len(specs) and i%every==0): # same URL as the previous service of the same spec
+            url = rows[i-len(specs)][1]
+        else:
+            url = "http://host%d.example.org/service/%d?" % (i%nb_hosts, i)
+        rows.append(("ivo://bench/%d" % i, url, today_s, today_s, spec, specv, query_rr.validatorParams[spec]))
+
+    query = "INSERT INTO services (id,url,date_insert,date_update,spec,specv,params) VALUES (?,?,?,?,?,?,?)"
+    with db.batch(conn):
+        db.executemany_db(conn, query, rows)
+    conn.close()
+
+
+def run_val(db_file, validator_url, engine, nb_workers, timeout, val_args, work_dir):
+    '''
+    run val.py on the DB
+    :return: statistics written by val.py --stats
+    '''
+    stats_file = os.path.join(work_dir, "stats.json")
+    log_file = os.path.join(work_dir, "val-%s-%d.log" % (engine, nb_workers))
+    cmd = [sys.executable, os.path.join(script_dir, "val.py"), "--db", db_file, "--validator-url", validator_url
+           , "--engine", engine, "--timeout", str(timeout), "--stats", stats_file, "--log", log_file]
+    if(engine=="thread"):
+        cmd += ["--concurrency", str(nb_workers)]
+    else:
+        cmd += ["--ps", str(nb_workers)]
+    cmd += val_args
+    logging.info("Running %s", " ".join(cmd))
+    subprocess.check_call(cmd)
+    with open(stats_file) as f:
+        return json.load(f)
+
+
+def usage():
+    '''
+    print usage
+    '''
+    print("Usage: %s -h --services <n> --engines <process,thread> --ps <n,n,..> --concurrency <n,n,..> --timeout <secs> --max-per-validator <n> --max-per-host <n> --dir <work_dir> --output <json_file> [stand-in validator options: --latency <distribution> --reports <distribution> --text-size <bytes> --error-rate <f> --hang-rate <f> --hang-secs <secs> --slow-rate <f> --slow-secs <secs> --truncate-rate <f> --seed <n>]" % sys.argv[0])
+
+
+def main(argv):
+    '''
+    main program
+    :param argv: parameters
+    '''
+
+    program_version="1.0"
+
+    nb_services = 1000 # nb of synthetic services
+    engines = ["process","thread"]
+    ps_list = [1,4,8] # nb of processes to try with engine process
+    concurrency_list = [20,100] # nb of threads to try with engine thread
+    timeout = 20
+    max_per_validator = 0 # no limit, there is only one stand-in server
+    max_per_host = 0
+    work_dir = None # temporary directory
+    output_file = None
+    settings = {}
+
+    stub_options = ["latency","reports","text-size","error-rate","hang-rate","hang-secs","slow-rate","slow-secs","truncate-rate","seed"]
+    try:
+        opts, args = getopt.getopt(argv,"h",["services=","engines=","ps=","concurrency=","timeout=","max-per-validator=","max-per-host=","dir=","output="]+[o+"=" for o in stub_options])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-h"):
+            usage()
+            sys.exit(0)
+        elif o in ("--services"):
+            nb_services = int(a)
+        elif o in ("--engines"):
+            engines = a.split(",")
+        elif o in ("--ps"):
+            ps_list = [int(n) for n in a.split(",")]
+        elif o in ("--concurrency"):
+            concurrency_list = [int(n) for n in a.split(",")]
+        elif o in ("--timeout"):
+            timeout = int(a)
+        elif o in ("--max-per-validator"):
+            max_per_validator = int(a)
+        elif o in ("--max-per-host"):
+            max_per_host = int(a)
+        elif o in ("--dir"):
+            work_dir = a
+        elif o in ("--output"):
+            output_file = a
+        else: # stand-in validator option
+            key = o[2:].replace("-","_")
+            if(key in ("latency","reports")):
+                settings[key] = a
+            elif(key=="seed"):
+                settings[key] = int(a)
+            else:
+                settings[key] = float(a)
+
+    logging.basicConfig(format='%(asctime)s %(filename)s %(levelname)s: %(message)s', level=logging.INFO)
+    logging.info("This is bench-e2e.py version %s. argv=%s",program_version,argv)
+
+    if(work_dir==None):
+        work_dir = tempfile.mkdtemp(prefix="bench-e2e-")
+    elif(not os.path.isdir(work_dir)):
+        os.makedirs(work_dir)
+    db_file = os.path.join(work_dir, "bench.db")
+
+    server = stubval.start(0, settings)
+    logging.info("Stand-in validators on %s with %s", server.url(), server.settings)
+
+    val_args = ["--max-per-validator", str(max_per_validator), "--max-per-host", str(max_per_host)]
+
+    runs = []
+    for engine in engines:
+        if(engine=="thread"):
+            worker_counts = concurrency_list
+        else:
+            worker_counts = ps_list
+        for nb_workers in worker_counts:
+            seed_services(db_file, nb_services)
+            stats = run_val(db_file, server.url(), engine, nb_workers, timeout, val_args, work_dir)
+            stats["workers_asked"] = nb_workers
+            runs.append(stats)
+
+    server.shutdown()
+
+    print("%-8s %8s %10s %12s %10s %10s %10s" % ("engine","workers","services","services/s","p50 (s)","p99 (s)","DB (s)"))
+    for stats in runs:
+        print("%-8s %8d %10d %12.1f %10.3f %10.3f %10.2f" % (stats["engine"], stats["workers_asked"], stats["nb_services"]
+              , stats["services_per_sec"], stats["latency_p50_secs"], stats["latency_p99_secs"], stats["db_secs"]))
+
+    if(output_file!=None):
+        with open(output_file,"w") as f:
+            json.dump({"nb_services":nb_services, "settings":server.settings, "runs":runs}, f, indent=1, sort_keys=True)
+        logging.info("Results written to %s", output_file)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
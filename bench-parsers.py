@@ -0,0 +1,255 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : bench-parsers.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : Micro-benchmarks of the parsers of val.py and of its writes to the DB
+# NOTE           : the taplint JSON and DAL XML outputs are generated by stubval.py with 10 to 100k reports.
+#                : Each case runs in a forked process to measure its peak memory (ru_maxrss), the DB cases use
+#                : a temporary SQLite file. The results can be saved as a baseline and compared to it (--save, --compare)
+###########################################################################
+# HISTORY        :
+#                : Version 1.0
+#                :    - Created: 2026-10-17 to detect the slowdowns of the parsers and DB writes before the nightly run
+###########################################################################
+
+import sys
+import os
+import getopt
+import logging
+import resource
+import tempfile
+import shutil
+import random
+import json
+import time
+import imp
+import xml.etree.cElementTree as ET
+import db # my db module
+import val # my val module/program
+import stubval # my stand-in validators
+
+
+# directory of the scripts
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# query-rr.py can not be imported with import because of its name
+query_rr = imp.load_source("query_rr", os.path.join(script_dir, "query-rr.py"))
+
+
+# spec used for the DAL outputs
+dal_spec = "Simple Cone Search"
+
+
+def corpus(kind, nb_reports):
+    '''
+    :param kind: "tap" or "dal"
+    :param nb_reports: nb of reports of the output
+    :return: taplint JSON or DAL validator XML output, always the same for the same arguments
+    '''
+    rng = random.Random(nb_reports)
+    if(kind=="tap"):
+        return stubval.tap_output(nb_reports, rng)
+    else:
+        return stubval.dal_output(dal_spec, nb_reports, rng)
+
+
+def new_db(tmp_dir):
+    '''
+    :return: connection to a new DB with the services and errors tables and one service
+    '''
+    (fd, db_file) = tempfile.mkstemp(suffix=".db", dir=tmp_dir)
+    os.close(fd)
+    conn = db.open_db(db_file)
+    query_rr.create_table_services(conn)
+    query_rr.create_table_errors(conn)
+    db.migrate(conn)
+    db.execute_db(conn, "INSERT INTO services (id,url,spec,specv) VALUES (?,?,?,?)", ("ivo://bench/1","http://bench.example.org/1",dal_spec,"1.03"))
+    return conn
+
+
+def bench_parse_tap_validator(n, tmp_dir):
+    data = corpus("tap", n)
+    t = time.time()
+    val.parse_tap_validator(data)
+    return (time.time()-t, n)
+
+
+def bench_parse_dal_validator(n, tmp_dir):
+    data = corpus("dal", n)
+    t = time.time()
+    val.parse_dal_validator(dal_spec, data)
+    return (time.time()-t, n)
+
+
+def bench_extract_dal_errors(n, tmp_dir):
+    nodes = list(ET.fromstring(corpus("dal", n)))
+    t = time.time()
+    val.extract_dal_errors(nodes)
+    return (time.time()-t, n)
+
+
+def bench_update_service(n, tmp_dir):
+    results = val.parse_dal_validator(dal_spec, corpus("dal", n))
+    conn = new_db(tmp_dir)
+    t = time.time()
+    with db.batch(conn):
+        val.update_service(conn, [("ivo://bench/1","http://bench.example.org/1")], results)
+    secs = time.time()-t
+    conn.close()
+    return (secs, n)
+
+
+def bench_upsert_error(n, tmp_dir):
+    conn = new_db(tmp_dir)
+    t = time.time()
+    with db.batch(conn):
+        for num in range(1, n+1):
+            val.upsert_error(conn, "ivo://bench/1", "http://bench.example.org/1", "2026-10-17", "error", num, "3.%d" % (num%20), "msg", "")
+    secs = time.time()-t
+    conn.close()
+    return (secs, n)
+
+
+# the benchmarks: name -> function(nb of reports, temporary directory) returning (secs, nb of rows/reports processed)
+benchmarks = [
+     ("parse_tap_validator", bench_parse_tap_validator)
+    ,("parse_dal_validator", bench_parse_dal_validator)
+    ,("extract_dal_errors", bench_extract_dal_errors)
+    ,("update_service", bench_update_service)
+    ,("upsert_error", bench_upsert_error)
+]
+
+
+def run_forked(function, n, tmp_dir):
+    '''
+    run a benchmark function in a forked process
+    :return: {"secs":..,"rows":..,"peak_kb":..}, peak_kb being the increase of the peak memory of the process during the benchmark
+    '''
+    (r, w) = os.pipe()
+    pid = os.fork()
+    if(pid==0): # child
+        os.close(r)
+        try:
+            rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            (secs, rows) = function(n, tmp_dir)
+            rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(w, json.dumps({"secs":secs, "rows":rows, "peak_kb":rss_end-rss_start}))
+        finally:
+            os.close(w)
+            os._exit(0)
+    os.close(w)
+    data = ""
+    while(True):
+        chunk = os.read(r, 65536)
+        if(not chunk):
+            break
+        data += chunk
+    os.close(r)
+    os.waitpid(pid, 0)
+    if(not data):
+        raise RuntimeError("Benchmark failed in process %d" % pid)
+    return json.loads(data)
+
+
+def usage():
+    '''
+    print usage
+    '''
+    print("Usage: %s -h --sizes <n,n,..> --only <name,name,..> --repeat <n> --save <baseline_file> --compare <baseline_file> --tolerance <fraction>" % sys.argv[0])
+    print("benchmarks: %s" % ", ".join([name for (name, function) in benchmarks]))
+
+
+def main(argv):
+    '''
+    main program
+    :param argv: parameters
+    '''
+
+    program_version="1.0"
+
+    sizes = [10,100,1000,10000,100000] # nb of reports of the generated outputs
+    only = None # names of the benchmarks to run (None = all)
+    repeat = 3 # each case is run repeat times, the fastest run is kept
+    save_file = None
+    compare_file = None
+    tolerance = 0.2 # a case is a regression if it is slower (or uses more memory) than the baseline by more than this fraction
+
+    try:
+        opts, args = getopt.getopt(argv,"h",["sizes=","only=","repeat=","save=","compare=","tolerance="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-h"):
+            usage()
+            sys.exit(0)
+        elif o in ("--sizes"):
+            sizes = [int(n) for n in a.split(",")]
+        elif o in ("--only"):
+            only = a.split(",")
+        elif o in ("--repeat"):
+            repeat = int(a)
+        elif o in ("--save"):
+            save_file = a
+        elif o in ("--compare"):
+            compare_file = a
+        elif o in ("--tolerance"):
+            tolerance = float(a)
+
+    # the functions of val.py log each report: not what is measured here
+    logging.disable(logging.CRITICAL)
+
+    baseline = None
+    if(compare_file!=None):
+        with open(compare_file) as f:
+            baseline = json.load(f)["results"]
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench-parsers-")
+    results = {}
+    nb_regressions = 0
+    print("%-30s %10s %10s %12s %10s  %s" % ("case","secs","rows/s","peak (KB)","vs base",""))
+    try:
+        for (name, function) in benchmarks:
+            if(only!=None and name not in only):
+                continue
+            for n in sizes:
+                case = "%s/%d" % (name, n)
+                runs = [run_forked(function, n, tmp_dir) for i in range(repeat)]
+                secs = min([r["secs"] for r in runs])
+                result = {
+                     "secs"         : secs
+                    ,"rows_per_sec" : runs[0]["rows"]/secs if secs>0 else 0
+                    ,"peak_kb"      : max([r["peak_kb"] for r in runs])
+                }
+                results[case] = result
+
+                comparison = ""
+                flag = ""
+                if(baseline!=None and case in baseline):
+                    base = baseline[case]
+                    ratio = secs/base["secs"] if base["secs"]>0 else 1
+                    comparison = "%.2fx" % ratio
+                    if(ratio>1+tolerance or result["peak_kb"]>max(base["peak_kb"],1024)*(1+tolerance)):
+                        flag = "REGRESSION"
+                        nb_regressions += 1
+                print("%-30s %10.4f %10.0f %12d %10s  %s" % (case, secs, result["rows_per_sec"], result["peak_kb"], comparison, flag))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if(save_file!=None):
+        with open(save_file,"w") as f:
+            json.dump({"version":program_version, "date":time.strftime('%Y-%m-%d %H:%M:%S'), "repeat":repeat, "results":results}, f, indent=1, sort_keys=True)
+        print("Baseline saved to %s" % save_file)
+
+    if(nb_regressions>0):
+        print("%d regressions compared to %s" % (nb_regressions, compare_file))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
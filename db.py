@@ -8,6 +8,29 @@
 # NOTE           : 
 ###########################################################################
 # HISTORY        : 
+#                : Version 1.7 2026-10-17
+#                :    - added insert_messages(): the messages are added with INSERT OR IGNORE, a message id already used by another
+#                :      text (collision of the truncated hash of message_id) raises ValueError instead of being ignored. The messages
+#                :      checked are kept per connection (Connection.messages), so a message already seen costs no query
+#                :    - migration 5: table timings, time spent in each phase of the validations of each run of val.py
+#                : Version 1.6 2026-10-17
+#                :    - the statements are timed per template (execution, waiting for the lock of the DB, commits), see query_stats
+#                :      and log_query_stats(). The write transactions start with BEGIN IMMEDIATE, whose time is the time waiting for
+#                :      the lock of the DB (the busy timeout is still handled by sqlite3)
+#                :    - execute_db() renders the statement for the log only if DEBUG is enabled
+#                : Version 1.5 2026-10-17
+#                :    - open_db() takes a performance profile (see profiles): journal mode (WAL), synchronous, mmap, cache and temp store
+#                :      settings, and the checkpoint of the WAL done at the end of a batch
+#                : Version 1.4 2026-10-17
+#                :    - open_db() applies the migrations of the schema not applied yet (see migrations), the version is kept in
+#                :      table schema_version. The conversions of the former errors tables (errors, error_refs) to table error_intervals
+#                :      and the view errors, done by query-rr.py before, are migrations (message_id() moved from val.py for them)
+#                :    - added full_scans() to check the plans of the queries
+#                : Version 1.3 2026-10-17
+#                :    - connections are opened in autocommit mode (isolation_level=None), transactions are now explicit:
+#                :      transaction() groups statements into one transaction, batch() groups several transactions and commits them
+#                :      according to a CommitPolicy (every N rows or every T seconds)
+#                :    - added executemany_db() to write many rows with one call
 #                : Version 1.2
 #                :    - do a commit() only when sql query starts with INSERT or UPDATE or CREATE
 #                : Version 1.1
@@ -22,12 +45,367 @@ import sqlite3
 import os
 import sys
 import logging
+import time
+import contextlib
+import threading
+import hashlib
+import itertools
 
 
-def open_db(db_file):
+# SQL commands which write to the DB
+write_commands = ("INSERT","UPDATE","CREATE","DELETE","REPLACE","DROP","ALTER")
+
+
+# query to add a message to table messages if it is not there yet, see insert_messages
+insert_message_query = "INSERT OR IGNORE INTO messages (msg_id,msg,section) VALUES (?, ?, ?)"
+
+
+def message_text(msg, section):
+    '''
+    :param msg: error msg
+    :param section: section for error
+    :return: msg and section as one utf-8 string, None being the same as ""
+    '''
+    parts = []
+    for s in (msg, section):
+        if(s==None):
+            s = ""
+        if(isinstance(s,unicode)):
+            s = s.encode("utf-8")
+        parts.append(s)
+    return "\0".join(parts)
+
+
+def message_id(msg, section):
+    '''
+    id of a message in table messages: the same message always gets the same id, so it is known without querying the DB
+    :param msg: error msg
+    :param section: section for error
+    :return: 63 bits integer made from the SHA1 of msg and section
+    '''
+    return int(hashlib.sha1(message_text(msg, section)).hexdigest()[0:16],16) & 0x7FFFFFFFFFFFFFFF
+
+
+def insert_messages(conn, rows):
+    '''
+    add messages to table messages if they are not there yet. The id being a truncated hash, two messages may get the same id:
+    the text of the messages already there is checked, else the new one would be shown with the text of the other
+    :param conn: sqlite3 connection object
+    :param rows: list of (msg_id, msg, section), msg_id from message_id()
+    :raise ValueError: if a message with the same id but another text is already there
+    '''
+    known = getattr(conn, "messages", {}) # the same messages come back for every service: they are checked once per connection
+    texts = {}
+    for (msg_id, msg, section) in rows:
+        text = message_text(msg, section)
+        if(known.get(msg_id)==text):
+            continue
+        texts[msg_id] = (text, msg, section)
+    if(not texts):
+        return
+    ids = texts.keys()
+    cur = executemany_db(conn, insert_message_query, [(msg_id, texts[msg_id][1], texts[msg_id][2]) for msg_id in ids])
+    if(cur.rowcount<len(ids)): # some are already there: the stored texts are read with one query per chunk of ids
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            query = "SELECT msg_id, msg, section FROM messages WHERE msg_id IN (%s)" % ",".join("?"*len(chunk))
+            for row in execute_db(conn, query, chunk).fetchall():
+                stored = message_text(row[1], row[2])
+                if(stored!=texts[row[0]][0]):
+                    raise ValueError("Message id %d of message %r (section %r) already used by message %r (section %r)"
+                                     % (row[0], texts[row[0]][1], texts[row[0]][2], row[1], row[2]))
+    for msg_id in ids:
+        known[msg_id] = texts[msg_id][0]
+
+
+def convert_errors(conn):
+    '''
+    migration: move the rows of the errors table of query-rr.py before v1.6 (msg and section in each row) to tables messages
+    and error_refs (converted by convert_error_refs), then drop it. Nothing to do if errors is not a table
+    :param conn: sqlite3 connection object
+    '''
+    cur = execute_db(conn, "SELECT type FROM sqlite_master WHERE name='errors'", [], True)
+    row = cur.fetchone()
+    if(row==None or row[0]!="table"):
+        return
+    
+    logging.info("Converting table errors to tables messages and error_refs")
+    
+    conn.create_function("message_id", 2, message_id)
+    
+    query = """
+        CREATE TABLE error_refs (id TEXT NOT NULL, url TEXT NOT NULL, date TEXT, type TEXT, num INT, name TEXT, msg_id INT)
+    """
+    execute_db(conn, query, [], True)
+    execute_db(conn, "CREATE UNIQUE INDEX error_refs_pk ON error_refs (id,url,date,type,num,name)", [], True)
+    
+    query = """
+        INSERT OR IGNORE INTO messages (msg_id,msg,section)
+        SELECT message_id(msg,section), msg, section FROM errors
+    """
+    execute_db(conn, query, [], True)
+    
+    # a message ignored because its id is already used by another message (see insert_messages) would get the text of the other
+    conn.create_function("message_text", 2, message_text)
+    query = """
+        SELECT e.msg, e.section, m.msg, m.section FROM errors e JOIN messages m ON m.msg_id = message_id(e.msg,e.section)
+        WHERE message_text(e.msg,e.section) != message_text(m.msg,m.section) LIMIT 1
+    """
+    row = execute_db(conn, query, [], True).fetchone()
+    if(row!=None):
+        raise ValueError("Message %r (section %r) has the same id as message %r (section %r)" % row)
+    
+    # the unique index of errors was never created (see query-rr.py v1.5): for duplicates, the last row is kept
+    query = """
+        INSERT OR REPLACE INTO error_refs (id,url,date,type,num,name,msg_id)
+        SELECT id, url, date, type, num, name, message_id(msg,section) FROM errors ORDER BY rowid
+    """
+    execute_db(conn, query, [], True)
+    
+    execute_db(conn, "DROP TABLE errors", [], True)
+    
+    logging.info("Table errors converted")
+
+
+def convert_error_refs(conn, batch_size=10000):
+    '''
+    migration: convert the errors of each date of table error_refs (query-rr.py v1.6) to intervals in table error_intervals,
+    then drop it. Nothing to do if there is no table error_refs.
+    The dates of the validations of a service are taken as the dates when errors were found for it (kept in table error_dates):
+    the consecutive dates when an error was found make an interval.
+    The rows are read with a cursor batch_size at a time, only the rows of one service are in memory
+    :param conn: sqlite3 connection object
+    :param batch_size: nb of rows read and written at a time
+    '''
+    cur = execute_db(conn, "SELECT count(*) FROM sqlite_master WHERE type='table' AND name='error_refs'", [], True)
+    if(cur.fetchone()[0]==0):
+        return
+    
+    logging.info("Converting table error_refs to table error_intervals")
+    
+    query = """
+        INSERT OR REPLACE INTO error_intervals (id,url,type,num,name,msg_id,first_seen,last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    query_dates = "INSERT OR IGNORE INTO error_dates (id,url,date) VALUES (?, ?, ?)"
+    
+    # NB: error_refs is not written while it is read, the index error_refs_pk gives the order
+    cur = execute_db(conn, "SELECT id,url,date,type,num,name,msg_id FROM error_refs ORDER BY id,url,date", [], True)
+    rows = itertools.chain.from_iterable(iter(lambda: cur.fetchmany(batch_size), []))
+    
+    nb_intervals = 0
+    interval_rows = []
+    date_rows = []
+    for ((ivoid, url), service_rows) in itertools.groupby(rows, lambda row: row[0:2]):
+        service_rows = list(service_rows) # the rows of one service
+        
+        dates = sorted(set([row[2] for row in service_rows]))
+        date_index = dict([(date, k) for (k, date) in enumerate(dates)])
+        date_rows.extend([(ivoid, url, date) for date in dates])
+        
+        # (type,num,name,msg_id) -> list of intervals [first_seen, last_seen]
+        intervals = {}
+        for row in service_rows:
+            (date, error) = (row[2], row[3:7])
+            error_intervals = intervals.setdefault(error, [])
+            if(error_intervals and date_index[error_intervals[-1][1]]==date_index[date]-1):
+                error_intervals[-1][1] = date
+            else:
+                error_intervals.append([date, date])
+        
+        for (error, error_intervals) in intervals.items():
+            for (first_seen, last_seen) in error_intervals:
+                interval_rows.append((ivoid, url)+tuple(error)+(first_seen, last_seen))
+        
+        if(len(interval_rows)+len(date_rows)>=batch_size):
+            executemany_db(conn, query, interval_rows, True)
+            executemany_db(conn, query_dates, date_rows, True)
+            nb_intervals += len(interval_rows)
+            interval_rows = []
+            date_rows = []
+    
+    executemany_db(conn, query, interval_rows, True)
+    executemany_db(conn, query_dates, date_rows, True)
+    nb_intervals += len(interval_rows)
+    
+    execute_db(conn, "DROP TABLE error_refs", [], True)
+    
+    logging.info("Table error_refs converted to %d intervals", nb_intervals)
+
+
+# migrations of the schema, applied in order by migrate(): (version, description, tables which must exist, statements), a statement
+# being SQL or a function called with the connection
+# NB: the tables are created by query-rr.py, a migration is postponed until its tables exist
+migrations = [
+     (1, "covering index for the services to validate (val.py main)", ["services"], [
+         "CREATE INDEX IF NOT EXISTS services_due ON services (date_update,id,url,spec,specv,params)"
+     ])
+    ,(2, "former errors table (query-rr.py before v1.6) converted to tables messages and error_refs", ["messages"], [
+         convert_errors
+     ])
+    ,(3, "table error_refs (query-rr.py v1.6) converted to tables error_intervals and error_dates", ["error_intervals","error_dates"], [
+         convert_error_refs
+     ])
+    ,(4, "view errors: the errors of each date when errors were found for a service, like the former errors table", ["messages","error_intervals","error_dates"], [
+         "DROP VIEW IF EXISTS errors" # in query-rr.py v1.7, the view gave only the last date of the intervals
+        ,"""
+         CREATE VIEW errors AS
+         SELECT d.id, d.url, d.date, e.type, e.num, e.name, m.msg, m.section
+         FROM error_dates d
+         JOIN error_intervals e ON e.id = d.id AND e.url = d.url AND e.first_seen <= d.date AND e.last_seen >= d.date
+         JOIN messages m ON m.msg_id = e.msg_id
+         """
+     ])
+    ,(5, "table timings of the phases of the validations (val.py, report.py)", ["services"], [
+         """
+         CREATE TABLE IF NOT EXISTS timings (
+              run TEXT NOT NULL           /* start of the run of val.py: YYYY-MM-DD HH:MM:SS */
+             ,id TEXT NOT NULL            /* first service of the services validated together (same URL, spec and params) */
+             ,url TEXT NOT NULL
+             ,spec TEXT
+             ,host TEXT                   /* host of the URL of the service */
+             ,nb_services INT             /* nb of services validated together */
+             ,outcome TEXT                /* ok, partial, stored, not stored, http <status> or name of the exception */
+             ,http_status INT
+             ,size INT                    /* nb of bytes of the output of the validator */
+             ,connect_secs REAL           /* DNS and connection to the validator (0 if the connection was reused) */
+             ,ttfb_secs REAL              /* from sending the request to getting the headers of the response */
+             ,read_secs REAL              /* reading the body of the response */
+             ,parse_secs REAL             /* parsing the output, without the time reading it */
+             ,db_secs REAL                /* writing the results to the DB (writer) */
+             ,total_secs REAL             /* whole validation by the worker (without db_secs) */
+         )
+         """
+        ,"CREATE UNIQUE INDEX IF NOT EXISTS timings_pk ON timings (run,id,url)"
+     ])
+]
+
+
+# performance profiles of open_db(): PRAGMA settings of the connection, and checkpoint of the WAL at the end of a batch (None = none)
+# - default: settings of sqlite3 (rollback journal, full sync at each commit), the journal mode of the DB is not changed
+# - wal: readers (ex: the results webapp) do not block the writer, a commit is synced only at the checkpoints
+# - bulk: for a rebuild of the DB which can be done again if the machine crashes: no sync at all, bigger cache, the WAL is
+#   truncated at the end of the batch
+profiles = {
+     "default" : {"pragmas":[], "checkpoint":None}
+    ,"wal"     : {"pragmas":[("journal_mode","WAL"),("synchronous","NORMAL"),("mmap_size",268435456),("cache_size",-65536),("temp_store","MEMORY")]
+                 ,"checkpoint":"PASSIVE"}
+    ,"bulk"    : {"pragmas":[("journal_mode","WAL"),("synchronous","OFF"),("mmap_size",1073741824),("cache_size",-262144),("temp_store","MEMORY")]
+                 ,"checkpoint":"TRUNCATE"}
+}
+
+
+# upper bounds (secs) of the buckets of the histograms of the execution times of the statements
+histogram_bounds = [0.0001, 0.001, 0.01, 0.1, 1, 10]
+histogram_labels = ["<0.1ms", "<1ms", "<10ms", "<100ms", "<1s", "<10s", ">=10s"]
+
+# statistics of the statements executed by this process: template of the statement -> QueryStats
+query_stats = {}
+query_stats_lock = threading.Lock() # the writer and the main thread share them with the engine thread of val.py
+
+
+class QueryStats(object):
+    '''
+    statistics of the executions of a statement template
+    '''
+    def __init__(self):
+        self.count = 0 # nb of executions
+        self.rows = 0 # nb of rows written (or of rows of values for executemany_db)
+        self.secs = 0.0 # total execution time
+        self.max_secs = 0.0
+        self.busy_secs = 0.0 # total time waiting for the lock of the DB (statements run by begin())
+        self.histogram = [0]*len(histogram_labels) # nb of executions per bucket of execution time, see histogram_bounds
+    
+    def add(self, secs, rows, busy_secs):
+        self.count += 1
+        self.rows += rows
+        self.secs += secs
+        self.max_secs = max(self.max_secs, secs)
+        self.busy_secs += busy_secs
+        i = 0
+        while(i<len(histogram_bounds) and secs>=histogram_bounds[i]):
+            i += 1
+        self.histogram[i] += 1
+    
+    def merge(self, other):
+        '''
+        add the statistics of another process
+        '''
+        self.count += other.count
+        self.rows += other.rows
+        self.secs += other.secs
+        self.max_secs = max(self.max_secs, other.max_secs)
+        self.busy_secs += other.busy_secs
+        self.histogram = [a+b for (a, b) in zip(self.histogram, other.histogram)]
+
+
+class Statement(object):
+    '''
+    statement with its values, rendered as SQL only when logged (from
+    https://stackoverflow.com/questions/5266430/how-to-see-the-real-sql-query-in-python-cursor-execute)
+    '''
+    def __init__(self, sql, values):
+        self.sql = sql
+        self.values = values
+    
+    def __str__(self):
+        unique = "%PARAMETER%"
+        sqld = self.sql.replace("?", unique)
+        for v in self.values: sqld = sqld.replace(unique, repr(v).lstrip("u"), 1)
+        return sqld
+
+
+class Connection(sqlite3.Connection):
+    '''
+    sqlite3 connection which keeps track of the transactions and batch opened with transaction() and batch()
+    '''
+    def __init__(self, *args, **kwargs):
+        sqlite3.Connection.__init__(self, *args, **kwargs)
+        self.tx_depth = 0 # nb of nested transaction() blocks currently open
+        self.policy = None # CommitPolicy of the batch() currently open, None if no batch
+        self.profile = profiles["default"] # performance profile, set by open_db()
+        self.messages = {} # msg_id -> message_text() of the messages known to be in table messages, see insert_messages()
+
+
+class CommitPolicy(object):
+    '''
+    commit policy of a batch: commit every max_rows rows written or every max_secs seconds, whichever comes first
+    (0 disables the corresponding limit)
+    '''
+    def __init__(self, max_rows=1000, max_secs=10):
+        self.max_rows = max_rows
+        self.max_secs = max_secs
+        self.reset()
+        
+    def reset(self):
+        '''
+        start a new batch
+        '''
+        self.rows = 0
+        self.start = time.time()
+        
+    def add(self, nb_rows):
+        '''
+        account for rows written in the current batch
+        '''
+        self.rows += nb_rows
+        
+    def due(self):
+        '''
+        :return: True if the current batch should be committed now
+        '''
+        if(self.max_rows>0 and self.rows>=self.max_rows):
+            return True
+        if(self.max_secs>0 and time.time()-self.start>=self.max_secs):
+            return True
+        return False
+
+
+def open_db(db_file, profile="default"):
     '''
     open a sqlite3 file and return connection
     :param db: name of sqlite3 db file
+    :param profile: name of the performance profile of the connection, see profiles
     :return: sqlite3 connection object
     '''
     #global logger
@@ -36,7 +414,8 @@ def open_db(db_file):
     logging.info("Opening or creating db=%s",db_file)
     try:
         lock_timeout=30; # default timeout is 5 secs, increase it to 30 to avoid "EXCEPTION database is locked while executing query"
-        conn = sqlite3.connect(db_file,lock_timeout)
+        # autocommit mode: statements executed outside of transaction() or batch() are committed right away
+        conn = sqlite3.connect(db_file,lock_timeout,isolation_level=None,factory=Connection)
         #conn.row_factory = sqlite3.Row # not used because we need a regular array to split it later
     except: 
         logging.error("Could not open db %s",db_file)
@@ -47,9 +426,272 @@ def open_db(db_file):
     # could do that in Python3 ? 
     #conn.set_trace_callback(logging.debug)
     
+    set_profile(conn, profile)
+    migrate(conn)
+    
     return conn
 
 
+def set_profile(conn, profile):
+    '''
+    apply the PRAGMA settings of a performance profile to a connection
+    :param conn: sqlite3 connection object
+    :param profile: name of the profile, see profiles
+    '''
+    if(profile not in profiles):
+        raise ValueError("Unknown DB profile %s, use one of %s" % (profile, ", ".join(sorted(profiles))))
+    conn.profile = profiles[profile]
+    for (name, value) in conn.profile["pragmas"]:
+        result = run(conn, "PRAGMA %s=%s" % (name, value)).fetchone()
+        if(name=="journal_mode" and (result==None or result[0].upper()!=value)): # ex: DB on a network file system
+            logging.warning("Could not set journal_mode=%s, journal_mode is %s",value,result[0] if result!=None else None)
+    logging.info("Using DB profile %s: %s",profile,", ".join(["%s=%s" % (name, value) for (name, value) in conn.profile["pragmas"]]) or "sqlite3 settings")
+
+
+def checkpoint(conn):
+    '''
+    checkpoint the WAL according to the profile of the connection (nothing if the profile has no checkpoint or the DB is not in WAL mode)
+    :param conn: sqlite3 connection object
+    '''
+    mode = conn.profile["checkpoint"]
+    if(mode==None):
+        return
+    t = time.time()
+    (busy, nb_log, nb_checkpointed) = run(conn, "PRAGMA wal_checkpoint(%s)" % mode).fetchone()
+    if(nb_log>=0): # -1 if not in WAL mode
+        logging.info("WAL checkpoint %s: %d of %d pages written in %.3f secs%s",mode,nb_checkpointed,nb_log,time.time()-t
+                     ," (not complete, readers are using the DB)" if busy or nb_checkpointed<nb_log else "")
+
+
+def schema_version(conn):
+    '''
+    :param conn: sqlite3 connection object
+    :return: version of the schema of the DB (0 if no migration was applied)
+    '''
+    run(conn, """
+        CREATE TABLE IF NOT EXISTS schema_version (
+             version INT NOT NULL        /* version of the schema, see db.migrations */
+            ,date TEXT                   /* date the migration was applied */
+            ,description TEXT            /* what the migration does */
+        )
+    """)
+    return run(conn, "SELECT COALESCE(max(version),0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn):
+    '''
+    apply the migrations which are not applied yet, each one in a transaction.
+    Stops at the first migration whose tables do not exist yet (ex: new DB before query-rr.py creates them).
+    The DB is vacuumed if the migrations left more than half of it free (ex: the former errors tables were dropped)
+    :param conn: sqlite3 connection object
+    '''
+    version = schema_version(conn)
+    nb_applied = 0
+    for (migration_version, description, tables, statements) in migrations:
+        if(migration_version<=version):
+            continue
+        missing = [table for table in tables
+                   if run(conn, "SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?",(table,)).fetchone()[0]==0]
+        if(missing):
+            logging.info("Schema migration %d postponed, table %s does not exist yet",migration_version,missing[0])
+            break
+        with transaction(conn):
+            if(schema_version(conn)>=migration_version): # applied by another process meanwhile
+                continue
+            for sql in statements:
+                if(callable(sql)):
+                    sql(conn)
+                else:
+                    execute_db(conn, sql, [], True)
+            execute_db(conn, "INSERT INTO schema_version (version,date,description) VALUES (?,datetime('now'),?)", (migration_version,description), True)
+        logging.info("Schema migrated to version %d: %s",migration_version,description)
+        nb_applied += 1
+    
+    if(nb_applied>0):
+        nb_free = run(conn, "PRAGMA freelist_count").fetchone()[0]
+        nb_pages = run(conn, "PRAGMA page_count").fetchone()[0]
+        if(nb_free*2>nb_pages):
+            logging.info("Vacuuming DB: %d of %d pages free after the migrations",nb_free,nb_pages)
+            execute_db(conn, "VACUUM") # NB: not in a transaction
+
+
+def full_scans(conn, sql, values=[]):
+    '''
+    find the steps of the plan of a query which read a whole table or index (EXPLAIN QUERY PLAN)
+    :param conn: sqlite3 connection object
+    :param sql: sql string with ? placeholders
+    :param values: values for the placeholders
+    :return: (list of the details of all the steps of the plan, list of those which are full scans)
+    '''
+    plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN "+sql, values)]
+    scans = [detail for detail in plan if detail.startswith("SCAN ")]
+    return (plan, scans)
+
+
+def commit_batch(conn):
+    '''
+    commit the batch currently open on the connection and start a new one
+    :param conn: sqlite3 connection object
+    '''
+    logging.debug("Committing batch of %d rows",conn.policy.rows)
+    run(conn, "COMMIT")
+    begin(conn)
+    conn.policy.reset()
+
+
+def written(conn, nb_rows):
+    '''
+    account for rows written outside of any transaction(): inside a batch, commit it if the policy says so
+    (outside a batch, the statement was already autocommitted)
+    :param conn: sqlite3 connection object
+    :param nb_rows: nb of rows written
+    '''
+    if(conn.policy!=None):
+        conn.policy.add(nb_rows)
+        if(conn.tx_depth==0 and conn.policy.due()):
+            commit_batch(conn)
+
+
+def begin(conn):
+    '''
+    start a write transaction: BEGIN IMMEDIATE takes the lock of the DB at once (waiting for it up to the busy timeout of
+    the connection), so the statements of the transaction can not fail because another connection writes meanwhile.
+    Its time is the time waiting for the lock in query_stats
+    :param conn: sqlite3 connection object
+    '''
+    run(conn, "BEGIN IMMEDIATE", lock=True)
+
+
+@contextlib.contextmanager
+def transaction(conn):
+    '''
+    execute all the statements of the with block in one transaction: commit at the end of the block, rollback on exception.
+    transactions can be nested. Inside a batch(), the transaction is committed with the batch.
+    :param conn: sqlite3 connection object
+    '''
+    outermost = (conn.tx_depth==0 and conn.policy==None) # not in a transaction yet
+    name = "tx%d" % conn.tx_depth
+    if(outermost):
+        begin(conn)
+    else:
+        run(conn, "SAVEPOINT "+name)
+    conn.tx_depth += 1
+    try:
+        yield conn
+    except:
+        logging.error("Rolling back transaction after exception")
+        conn.messages = {} # may have been added by the transaction
+        if(outermost):
+            run(conn, "ROLLBACK")
+        else:
+            run(conn, "ROLLBACK TO "+name)
+            run(conn, "RELEASE "+name)
+        raise
+    else:
+        if(outermost):
+            run(conn, "COMMIT")
+        else:
+            run(conn, "RELEASE "+name)
+    finally:
+        conn.tx_depth -= 1
+        
+    # end of an outermost transaction in a batch: the batch can be committed
+    if(conn.tx_depth==0 and conn.policy!=None and conn.policy.due()):
+        commit_batch(conn)
+
+
+@contextlib.contextmanager
+def batch(conn, policy=None):
+    '''
+    group the statements and transactions of the with block in batches, committed according to the policy
+    :param conn: sqlite3 connection object
+    :param policy: CommitPolicy object (None => default policy)
+    '''
+    if(policy==None):
+        policy = CommitPolicy()
+    
+    conn.policy = policy
+    conn.policy.reset()
+    begin(conn)
+    try:
+        yield conn
+    except:
+        logging.error("Rolling back batch of %d rows after exception",conn.policy.rows)
+        conn.messages = {}
+        run(conn, "ROLLBACK")
+        raise
+    else:
+        logging.debug("Committing last batch of %d rows",conn.policy.rows)
+        run(conn, "COMMIT")
+        checkpoint(conn)
+    finally:
+        conn.policy = None
+
+
+def run(conn, sql, values=(), many=False, lock=False):
+    '''
+    execute a statement and add its execution time to query_stats. If another connection has the lock of the DB,
+    sqlite3 waits for it up to the busy timeout of the connection
+    :param conn: sqlite3 connection object
+    :param sql: sql string with ? placeholders
+    :param values: values for the placeholders, or list of them if many
+    :param many: True => executemany
+    :param lock: True => the statement only takes the lock of the DB (see begin()), its time is counted as time waiting for it
+    :return: the cursor
+    '''
+    cur = conn.cursor()
+    t = time.time()
+    if(many):
+        cur.executemany(sql, values)
+    else:
+        cur.execute(sql, values)
+    secs = time.time()-t
+    
+    template = " ".join(sql.split())
+    with query_stats_lock:
+        stats = query_stats.get(template)
+        if(stats==None):
+            stats = query_stats[template] = QueryStats()
+        stats.add(secs, max(cur.rowcount,0), secs if lock else 0.0)
+    return cur
+
+
+def merge_query_stats(stats):
+    '''
+    add the query_stats of another process (ex: the writer of val.py)
+    :param stats: its query_stats
+    '''
+    with query_stats_lock:
+        for (template, other) in stats.items():
+            query_stats.setdefault(template, QueryStats()).merge(other)
+
+
+def log_query_stats(max_width=70):
+    '''
+    log the statistics of the statements, the slowest in total first.
+    The COMMIT statements and the statements outside transactions include the time to commit, the BEGIN IMMEDIATE
+    statements are the time waiting for the lock of the DB
+    :param max_width: max nb of characters of the templates displayed
+    '''
+    with query_stats_lock:
+        items = sorted(query_stats.items(), key=lambda item: -item[1].secs)
+    if(not items):
+        return
+    logging.info("%-*s %8s %9s %9s %9s %9s %9s  %s",max_width,"statement","count","rows","secs","mean ms","max ms","busy secs"," ".join(["%7s" % l for l in histogram_labels]))
+    total = QueryStats()
+    commit_secs = 0.0
+    for (template, stats) in items:
+        if(len(template)>max_width):
+            template = template[:max_width-3]+"..."
+        logging.info("%-*s %8d %9d %9.3f %9.3f %9.3f %9.3f  %s",max_width,template,stats.count,stats.rows,stats.secs,1000*stats.secs/stats.count
+                     ,1000*stats.max_secs,stats.busy_secs," ".join(["%7d" % n for n in stats.histogram]))
+        total.merge(stats)
+        if(template=="COMMIT"):
+            commit_secs += stats.secs
+    logging.info("DB time: %.3f secs executing %d statements, including %.3f secs committing and %.3f secs waiting for the lock of the DB"
+                 ,total.secs,total.count,commit_secs,total.busy_secs)
+
+
 def execute_db(conn, sql, values=[], stop=False):
     '''
     execute a SQL query, print query before executing, handle exceptions
@@ -60,29 +702,26 @@ def execute_db(conn, sql, values=[], stop=False):
     :return: the cursor created (for the caller to get the results)
     '''
     
-    # Prepare sql string for display - from https://stackoverflow.com/questions/5266430/how-to-see-the-real-sql-query-in-python-cursor-execute
-    sqld = sql
-    unique = "%PARAMETER%"
-    sqld = sqld.replace("?", unique)
-    for v in values: sqld = sqld.replace(unique, repr(v).lstrip("u"), 1)
+    # sql string for display, rendered by logging only if it is displayed
+    sqld = Statement(sql, values)
 
     # Display query to be executed
     logging.debug("Executing query: %s",sqld)
 
     # Execute query
+    cur = conn.cursor() # returned even if the query fails
     try:
-        cur = conn.cursor()
-        cur.execute(sql,values) 
+        cur = run(conn, sql, values)
         
         logging.debug("Query executed OK")
         
         sqls = sql.split()
-        sql_command=sqls[0]
+        sql_command=sqls[0].upper()
         #logging.debug("SQL command was %s",sql_command)
         
-        if(sql_command in ("INSERT","UPDATE","CREATE")):
-            conn.commit()
-            logging.debug("commit() called after %s",sql_command)
+        # no commit() needed: the statement was autocommitted or will be committed with its transaction/batch
+        if(sql_command in write_commands):
+            written(conn, max(cur.rowcount,1))
         
         
     except Exception as e:
@@ -94,3 +733,33 @@ def execute_db(conn, sql, values=[], stop=False):
     
     return cur 
 
+
+def executemany_db(conn, sql, rows, stop=False):
+    '''
+    execute a SQL query once for each row of values, handle exceptions
+    :param conn: sqlite3 connection object
+    :param sql: sql string with ? placeholders
+    :param rows: list (or iterator) of values for the placeholders
+    :param stop: True => exit program in case of exception 
+    :return: the cursor created
+    '''
+    
+    logging.debug("Executing query for many rows: %s",sql)
+    
+    cur = conn.cursor() # returned even if the query fails
+    try:
+        cur = run(conn, sql, rows, True)
+        
+        logging.debug("Query executed OK for %d rows",cur.rowcount)
+        
+        sql_command=sql.split()[0].upper()
+        if(sql_command in write_commands):
+            written(conn, max(cur.rowcount,0))
+        
+    except Exception as e:
+        logging.error("EXCEPTION %s while executing query for many rows: %s",e,sql)
+        if(stop): 
+            logging.error("Aborting after last exception per caller request")
+            sys.exit(10)
+    
+    return cur
@@ -0,0 +1,411 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : httppool.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : Module for my pool of persistent HTTP connections to the validators
+# NOTE           :
+###########################################################################
+# HISTORY        :
+#                : Version 1.2 2026-10-17
+#                :    - the connections are opened in a thread (connect()) so a slow DNS lookup can not go past the deadline, and the
+#                :      bodies of the redirections and errors are read within the deadline and the max size too
+#                :    - Response.eof tells if the body was read until its end
+#                :    - urlopen() takes an optional timings dict where the time spent connecting, waiting for the headers (time to first
+#                :      byte) and reading the body are added
+#                : Version 1.1 2026-10-17
+#                :    - urlopen() takes an optional Deadline for the whole request (connect, headers and body) and a max size for the body.
+#                :      ConnectTimeout, ReadTimeout and Oversize are raised (or recorded in Response.aborted) when they are exceeded.
+#                :      A timer shuts the socket down when the deadline passes, to cancel the reads blocked in httplib
+#                : Version 1.0
+#                :    - Created: 2026-10-17 to reuse the connections to the validators instead of opening one per service with urllib2
+###########################################################################
+
+
+import httplib
+import urlparse
+import socket
+import threading
+import contextlib
+import time
+import logging
+
+
+class HTTPError(Exception):
+    '''
+    raised for HTTP status >= 400, like urllib2.HTTPError
+    '''
+    def __init__(self, url, status, reason):
+        Exception.__init__(self, "HTTP Error %d: %s" % (status, reason))
+        self.url = url
+        self.status = status
+
+
+class Aborted(Exception):
+    '''
+    the request was aborted, see subclasses
+    '''
+    pass
+
+
+class ConnectTimeout(Aborted):
+    '''
+    the connection to the server could not be made before the deadline
+    '''
+    pass
+
+
+class ReadTimeout(Aborted):
+    '''
+    the response (headers or body) was not read before the deadline
+    '''
+    pass
+
+
+class Oversize(Aborted):
+    '''
+    the body of the response is bigger than the max size
+    '''
+    pass
+
+
+class Deadline(object):
+    '''
+    time at which a request must be finished
+    '''
+    def __init__(self, secs):
+        '''
+        :param secs: nb of seconds from now
+        '''
+        self.end = time.time()+secs
+
+    def remaining(self, timeout=None):
+        '''
+        :param timeout: if given, the result is at most timeout
+        :return: nb of seconds left before the deadline
+        '''
+        remaining = self.end-time.time()
+        if(timeout!=None and timeout<remaining):
+            return timeout
+        return remaining
+
+
+def connect(conn, timeout):
+    '''
+    open the connection in a thread: the DNS lookup done by connect() is not limited by the socket timeout
+    :param conn: httplib.HTTPConnection object
+    :param timeout: max nb of secs to wait for the connection, it is closed if it opens later
+    :raise socket.timeout: if the connection is not open after timeout secs
+    '''
+    done = threading.Event()
+    lock = threading.Lock()
+    state = {"error":None, "abandoned":False}
+    def run():
+        try:
+            conn.connect()
+        except Exception as e:
+            state["error"] = e
+        with lock:
+            done.set()
+            if(state["abandoned"]):
+                conn.close()
+    t = threading.Thread(target=run, name="Connect")
+    t.daemon = True
+    t.start()
+    done.wait(max(timeout,0))
+    with lock:
+        if(not done.is_set()):
+            state["abandoned"] = True
+            raise socket.timeout("not connected after %.3f secs (DNS lookup?)" % timeout)
+    if(state["error"]!=None):
+        raise state["error"]
+
+
+class Response(object):
+    '''
+    HTTP response whose body must be read before a deadline and is limited in size.
+    The exception which aborted the reading (Aborted or socket error) is kept in aborted, because the parsers reading
+    the body may catch it. eof is True once the end of the body has been read.
+    '''
+    def __init__(self, raw, sock, deadline=None, max_size=0, timings=None):
+        '''
+        :param raw: httplib.HTTPResponse object
+        :param sock: socket of the connection
+        :param deadline: Deadline object or None
+        :param max_size: max nb of bytes of the body (0 = no limit)
+        :param timings: dict where the time spent reading the body is added to read_secs, or None
+        '''
+        self.raw = raw
+        self.sock = sock
+        self.deadline = deadline
+        self.max_size = max_size
+        self.status = raw.status
+        self.reason = raw.reason
+        self.nb_bytes = 0
+        self.aborted = None
+        self.eof = False
+        self.timings = timings
+        if(timings!=None):
+            timings.setdefault("read_secs", 0.0)
+
+    def getheader(self, name, default=None):
+        return self.raw.getheader(name, default)
+
+    def read(self, n=-1):
+        '''
+        read n bytes of the body (all of it if n<0), the socket timeout is set to the time left before the deadline
+        '''
+        if(n<0): # read by chunks to check the deadline and size between them
+            chunks = []
+            while(True):
+                chunk = self.read(65536)
+                if(not chunk):
+                    return "".join(chunks)
+                chunks.append(chunk)
+
+        try:
+            if(self.deadline!=None):
+                remaining = self.deadline.remaining()
+                if(remaining<=0):
+                    raise ReadTimeout("Deadline passed after reading %d bytes" % self.nb_bytes)
+                if(self.sock!=None):
+                    self.sock.settimeout(remaining)
+            t = time.time()
+            try:
+                data = self.raw.read(n)
+            except socket.timeout as e:
+                raise ReadTimeout("Timeout after reading %d bytes: %s" % (self.nb_bytes, e))
+            except (httplib.HTTPException, socket.error) as e:
+                if(self.deadline!=None and self.deadline.remaining()<=0): # socket shut down by Pool.cancel
+                    raise ReadTimeout("Deadline passed after reading %d bytes: %s" % (self.nb_bytes, e))
+                raise
+            finally:
+                if(self.timings!=None):
+                    self.timings["read_secs"] += time.time()-t
+            if(self.deadline!=None and self.deadline.remaining()<=0): # the data may be cut by Pool.cancel
+                raise ReadTimeout("Deadline passed after reading %d bytes" % self.nb_bytes)
+            if(not data and n!=0):
+                if(self.raw.length): # httplib returns "" if the connection is closed before Content-Length bytes
+                    raise httplib.IncompleteRead("", self.raw.length)
+                self.eof = True
+            self.nb_bytes += len(data)
+            if(self.max_size>0 and self.nb_bytes>self.max_size):
+                raise Oversize("Response bigger than %d bytes" % self.max_size)
+        except Exception as e:
+            self.aborted = e
+            raise
+        return data
+
+
+class Pool(object):
+    '''
+    pool of persistent (keep-alive) HTTP connections, can be shared by several threads
+    '''
+
+    def __init__(self, size=20, idle_timeout=30):
+        '''
+        :param size: max nb of idle connections kept for each host
+        :param idle_timeout: idle connections older than this (secs) are closed instead of being reused
+        '''
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.idle = {} # (scheme,host,port) -> list of (connection, time it was last used)
+        self.lock = threading.Lock()
+        self.nb_opened = 0
+        self.nb_reused = 0
+
+    def get(self, key, timeout):
+        '''
+        get an idle connection for the host or open a new one
+        :param key: (scheme,host,port)
+        :param timeout: socket timeout of the connection
+        :return: (connection, True if it is reused)
+        '''
+        now = time.time()
+        with self.lock:
+            conns = self.idle.get(key,[])
+            while(conns):
+                (conn, last_used) = conns.pop()
+                if(now-last_used<self.idle_timeout and conn.sock!=None):
+                    self.nb_reused += 1
+                    conn.sock.settimeout(timeout)
+                    return (conn, True)
+                conn.close() # too old, the server has probably closed it
+            self.nb_opened += 1
+
+        (scheme, host, port) = key
+        if(scheme=="https"):
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        return (conn, False)
+
+    def put(self, key, conn):
+        '''
+        give back a connection whose last response was read entirely
+        '''
+        with self.lock:
+            conns = self.idle.setdefault(key,[])
+            if(len(conns)<self.size):
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def send(self, url, timeout, deadline=None, watched=[], timings=None):
+        '''
+        send a GET request, retrying once with a new connection if a reused one was closed by the server
+        :param watched: list where the socket used is put, for cancel() (conn.sock is closed by httplib when the server
+        closes the connection after the response, the body is then read from the socket of response.fp)
+        :param timings: dict where the time spent connecting and waiting for the headers are added to connect_secs and ttfb_secs, or None
+        :return: (key, connection, response)
+        '''
+        if(timings==None):
+            timings = {}
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if(parts.query):
+            path += "?"+parts.query
+
+        while(True):
+            if(deadline!=None):
+                timeout = deadline.remaining(timeout)
+                if(timeout<=0):
+                    raise ConnectTimeout("Deadline passed before connecting to %s" % parts.hostname)
+            (conn, reused) = self.get(key, timeout)
+            try:
+                if(conn.sock==None):
+                    t = time.time()
+                    try:
+                        connect(conn, timeout)
+                    except socket.timeout as e:
+                        raise ConnectTimeout("Timeout while connecting to %s: %s" % (parts.hostname, e))
+                    finally:
+                        timings["connect_secs"] = timings.get("connect_secs",0.0)+time.time()-t
+                watched[:] = [conn.sock]
+                t = time.time()
+                try:
+                    conn.request("GET", path)
+                    try:
+                        response = conn.getresponse()
+                    except socket.timeout as e:
+                        raise ReadTimeout("Timeout while waiting for the response of %s: %s" % (parts.hostname, e))
+                finally:
+                    timings["ttfb_secs"] = timings.get("ttfb_secs",0.0)+time.time()-t
+                watched[:] = [getattr(response.fp,"_sock",watched[0])] # the body is read from this one
+                return (key, conn, response)
+            except (httplib.HTTPException, socket.error, Aborted) as e:
+                conn.close()
+                if(deadline!=None and deadline.remaining()<=0 and not isinstance(e, Aborted)): # socket shut down by cancel()
+                    raise ReadTimeout("Deadline passed while waiting for the response of %s: %s" % (parts.hostname, e))
+                if(not reused or isinstance(e, (socket.timeout, Aborted))):
+                    raise
+                logging.debug("Reused connection to %s closed by server (%s), opening a new one", parts.hostname, e)
+
+    @contextlib.contextmanager
+    def urlopen(self, url, timeout, deadline=None, max_size=0, max_redirects=5, timings=None):
+        '''
+        open an URL with a pooled connection, following at most max_redirects redirections (HTTPError if there are more)
+        use: with pool.urlopen(url,timeout) as response: data = response.read()
+        the connection goes back to the pool at the end of the with block if the response was read entirely
+        :param url: URL to open
+        :param timeout: timeout for the socket operations
+        :param deadline: Deadline object for the whole request, including the reading of the body (None = no deadline)
+        :param max_size: max nb of bytes of the body (0 = no limit)
+        :param timings: dict where the time spent is added (secs): connect_secs (0 if the connection is reused), ttfb_secs
+        (from sending the request to getting the headers) and read_secs (reading the body), summed over the redirections. None = not timed
+        :return: Response object
+        '''
+        # a read blocked in httplib (which loops until it gets the nb of bytes asked for) is only stopped by the socket timeout
+        # if no data comes at all: when the deadline passes, the timer shuts the socket down to cancel it
+        watched = [] # socket in use
+        timer = None
+        if(deadline!=None):
+            timer = threading.Timer(max(deadline.remaining(),0), self.cancel, [watched])
+            timer.daemon = True
+            timer.start()
+
+        try:
+            for i in range(max_redirects+1):
+                (key, conn, raw) = self.send(url, timeout, deadline, watched, timings)
+                if(raw.status in (301,302,303,307) and raw.getheader("location")):
+                    self.discard(key, conn, Response(raw, watched[0], deadline, max_size, timings))
+                    url = urlparse.urljoin(url, raw.getheader("location"))
+                    logging.debug("Redirected to %s", url)
+                    continue
+                break
+            else: # the connection of the last redirection is already released
+                raise HTTPError(url, raw.status, "too many redirections")
+
+            if(raw.status>=400):
+                try:
+                    self.discard(key, conn, Response(raw, watched[0], deadline, max_size, timings))
+                except (Aborted, httplib.HTTPException, socket.error) as e: # the status is what matters
+                    logging.debug("Body of HTTP error %d not read: %s", raw.status, e)
+                raise HTTPError(url, raw.status, raw.reason)
+
+            response = Response(raw, watched[0], deadline, max_size, timings)
+            try:
+                yield response
+            except:
+                conn.close()
+                raise
+            else:
+                if(response.aborted!=None): # caught by the reader, the response was not read entirely
+                    conn.close()
+                else:
+                    self.release(key, conn, raw)
+        finally:
+            if(timer!=None):
+                timer.cancel()
+
+    def cancel(self, watched):
+        '''
+        shut the socket in use down, so the blocked socket operations fail at once
+        :param watched: list containing the socket in use, if any
+        '''
+        for sock in list(watched):
+            logging.debug("Deadline passed, cancelling the connection")
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def discard(self, key, conn, response):
+        '''
+        read the body of a response which is not given to the caller (redirection, error) then release its connection,
+        which is closed if the body could not be read
+        :param response: Response object, limited in time and size
+        '''
+        try:
+            response.read()
+        except:
+            conn.close()
+            raise
+        self.release(key, conn, response.raw)
+
+    def release(self, key, conn, response):
+        '''
+        put the connection back in the pool if it can be reused, else close it
+        '''
+        if(response.isclosed() and not response.will_close):
+            self.put(key, conn)
+        else:
+            conn.close()
+
+    def close(self):
+        '''
+        close all the idle connections
+        '''
+        with self.lock:
+            for conns in self.idle.values():
+                for (conn, last_used) in conns:
+                    conn.close()
+            self.idle = {}
+
+    def log_stats(self):
+        '''
+        log the nb of connections opened and reused
+        '''
+        logging.info("HTTP pool: %d connections opened, %d reused", self.nb_opened, self.nb_reused)
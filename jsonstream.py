@@ -0,0 +1,138 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : jsonstream.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : Module for my incremental reading of JSON documents
+# NOTE           : only the values asked for are decoded (with json.JSONDecoder.raw_decode), the document is read
+#                : chunk by chunk so the memory used does not depend on its size
+###########################################################################
+# HISTORY        :
+#                : Version 1.0
+#                :    - value() raises ValueError when max_value bytes (plus one chunk) are read without completing the value
+#                :    - Created: 2026-10-17 to parse the taplint JSON output of the TAP validator while it is read
+###########################################################################
+
+
+import json
+import re
+import logging
+
+
+# JSON whitespace
+whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class Truncated(Exception):
+    '''
+    raised when the JSON document ends before it is complete
+    '''
+    pass
+
+
+class JsonStream(object):
+    '''
+    incremental reader of a JSON document: the caller walks the structure with peek(), next(), expect() and value()
+    '''
+
+    def __init__(self, source, chunk_size=65536, max_value=1048576):
+        '''
+        :param source: JSON document, as a string or as a file-like object with a read() method
+        :param chunk_size: nb of bytes read at once from a file-like object
+        :param max_value: max nb of bytes of a value read by value(), ValueError is raised when more is read without completing it
+        '''
+        if(hasattr(source,"read")):
+            self.read = source.read
+            self.buf = ""
+        else:
+            self.read = None
+            self.buf = source
+        self.chunk_size = chunk_size
+        self.max_value = max_value
+        self.pos = 0 # position of the next char to read in buf
+        self.nb_bytes = len(self.buf) # nb of bytes read so far
+        self.error = None # exception raised by read(), if any
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        '''
+        read one more chunk of the document, dropping the part of the buffer already read
+        :return: False if there is no more data
+        '''
+        if(self.read==None):
+            return False
+        try:
+            chunk = self.read(self.chunk_size)
+        except Exception as e: # ex: timeout while reading, the document is truncated
+            logging.error("EXCEPTION %s while reading JSON data after %d bytes",e,self.nb_bytes)
+            self.error = e
+            chunk = ""
+        if(not chunk):
+            self.read = None
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.nb_bytes += len(chunk)
+        return True
+
+    def peek(self):
+        '''
+        skip whitespace
+        :return: the next char, without reading it
+        '''
+        while(True):
+            self.pos = whitespace.match(self.buf, self.pos).end()
+            if(self.pos<len(self.buf)):
+                return self.buf[self.pos]
+            if(not self.fill()):
+                raise Truncated("JSON data ends after %d bytes" % self.nb_bytes)
+
+    def next(self):
+        '''
+        :return: the next char, after skipping whitespace
+        '''
+        c = self.peek()
+        self.pos += 1
+        return c
+
+    def expect(self, c):
+        '''
+        read the next char, which must be c
+        '''
+        n = self.next()
+        if(n!=c):
+            raise ValueError("Expected %s but found %s at byte %d" % (c, n, self.nb_bytes-len(self.buf)+self.pos-1))
+
+    def skip(self, c):
+        '''
+        read the next char if it is c
+        :return: True if it was c
+        '''
+        if(self.peek()==c):
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        '''
+        read and decode the next JSON value (object, array, string, number...)
+        :return: the decoded value
+        '''
+        self.peek()
+        while(True):
+            try:
+                (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # the value is not complete in the buffer: read more. At the end of the data, the value can not be completed
+                # (NB: an invalid value is also reported as truncated, the validators only send invalid JSON when they time out).
+                # An invalid value is not completed by reading more: stop before the rest of the document is in the buffer
+                if(len(self.buf)-self.pos>self.max_value+self.chunk_size):
+                    raise ValueError("Invalid JSON value or value bigger than %d bytes at byte %d" % (self.max_value, self.nb_bytes-len(self.buf)+self.pos))
+                if(not self.fill()):
+                    raise Truncated("JSON data ends after %d bytes" % self.nb_bytes)
+                continue
+            if(end==len(self.buf) and self.fill()): # a number may continue in the next chunk
+                continue
+            self.pos = end
+            return value
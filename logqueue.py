@@ -0,0 +1,199 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : logqueue.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : Module for my logging through a queue: the processes and threads put their records in a queue, a listener
+#                : process is the only one to write them to the log file
+# NOTE           : Python 2 has no logging.handlers.QueueHandler/QueueListener, they are done here.
+#                : The levels are set per module (name of the .py file) because all the modules log with the root logger
+###########################################################################
+# HISTORY        :
+#                : Version 1.0
+#                :    - the listener stops if the main process is dead, checked every check_secs secs without record
+#                :    - Created: 2026-10-17 to stop the workers of val.py from writing to the log file at the same time and to
+#                :      truncate the big messages (outputs of the validators, SQL statements with their values)
+###########################################################################
+
+
+import os
+import sys
+import atexit
+import Queue
+import logging
+import multiprocessing
+
+
+# queue of the records and listener process, see setup()
+queue = None
+listener = None
+
+
+class ModuleLevelFilter(logging.Filter):
+    '''
+    keep the records whose level is at least the level of their module
+    '''
+    def __init__(self, level, levels={}):
+        '''
+        :param level: level of the modules which are not in levels
+        :param levels: module -> level
+        '''
+        logging.Filter.__init__(self)
+        self.level = level
+        self.levels = levels
+
+    def filter(self, record):
+        return record.levelno>=self.levels.get(record.module, self.level)
+
+
+def truncate(text, max_len):
+    '''
+    :param text: message
+    :param max_len: max nb of characters (0 = no limit)
+    :return: the message cut after max_len characters
+    '''
+    if(max_len>0 and len(text)>max_len):
+        return "%s... [%d more characters]" % (text[:max_len], len(text)-max_len)
+    return text
+
+
+class QueueHandler(logging.Handler):
+    '''
+    handler putting the records in a queue, once formatted and truncated (the arguments of the message may not be picklable
+    and big messages should not go through the queue)
+    '''
+    def __init__(self, queue, max_len=0):
+        '''
+        :param queue: multiprocessing.Queue read by the listener
+        :param max_len: max nb of characters of the messages (0 = no limit)
+        '''
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.max_len = max_len
+
+    def prepare(self, record):
+        record.msg = truncate(record.getMessage(), self.max_len)
+        record.args = None
+        if(record.exc_info):
+            record.exc_text = truncate(logging.Formatter().formatException(record.exc_info), self.max_len)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class TruncatingFormatter(logging.Formatter):
+    '''
+    formatter truncating the messages, when the records are not queued
+    '''
+    def __init__(self, fmt, max_len=0):
+        logging.Formatter.__init__(self, fmt)
+        self.max_len = max_len
+
+    def format(self, record):
+        record.msg = truncate(record.getMessage(), self.max_len)
+        record.args = None
+        return logging.Formatter.format(self, record)
+
+
+def listen(queue, handler, check_secs=10):
+    '''
+    listener process: handle the records of the queue until it gets None, or until the main process is dead (killed, stop()
+    was not called)
+    :param queue: queue of the records
+    :param handler: handler writing the records
+    :param check_secs: the main process is checked when no record came for check_secs seconds
+    '''
+    ppid = os.getppid()
+    while(True):
+        try:
+            record = queue.get(True, check_secs)
+        except KeyboardInterrupt: # the processes are stopped by the main one
+            continue
+        except Queue.Empty:
+            if(os.getppid()!=ppid):
+                break
+            continue
+        if(record==None):
+            break
+        handler.handle(record)
+    handler.close()
+
+
+def parse_levels(spec):
+    '''
+    :param spec: levels per module as module=LEVEL,module=LEVEL,... (ex: db=INFO,httppool=WARNING)
+    :return: module -> level
+    '''
+    levels = {}
+    for item in spec.split(","):
+        if(not item.strip()):
+            continue
+        (module, level) = item.split("=")
+        levels[module.strip()] = parse_level(level)
+    return levels
+
+
+def parse_level(name):
+    '''
+    :param name: name of a level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+    :return: level
+    '''
+    level = logging.getLevelName(name.strip().upper())
+    if(not isinstance(level, int)):
+        raise ValueError("Unknown log level %s" % name)
+    return level
+
+
+def setup(log_file, fmt, level=logging.INFO, levels={}, max_len=0, queued=True):
+    '''
+    configure the root logger. Call it before starting the other processes, they log through the queue too
+    :param log_file: log file, None for stderr
+    :param fmt: format of the records
+    :param level: level of the modules which are not in levels
+    :param levels: module (name of the .py file) -> level
+    :param max_len: max nb of characters of the messages (0 = no limit)
+    :param queued: True => the records are written by a listener process (several processes log), False => written by this process
+    '''
+    global queue, listener
+
+    if(log_file!=None):
+        handler = logging.FileHandler(log_file)
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.setLevel(min([level]+levels.values()))
+
+    if(queued):
+        handler.setFormatter(logging.Formatter(fmt))
+        queue = multiprocessing.Queue()
+        listener = multiprocessing.Process(target=listen, name="LogListener", args=(queue, handler))
+        listener.start()
+        atexit.register(stop) # registered after the exit function of multiprocessing, so called before it
+        handler = QueueHandler(queue, max_len)
+    else:
+        handler.setFormatter(TruncatingFormatter(fmt, max_len))
+
+    handler.addFilter(ModuleLevelFilter(level, levels))
+    root.addHandler(handler)
+
+
+def stop():
+    '''
+    write the records left in the queue and stop the listener
+    '''
+    global listener
+    if(listener!=None and listener.pid!=None and multiprocessing.current_process().name=="MainProcess"):
+        queue.put(None)
+        listener.join()
+        listener = None
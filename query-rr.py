@@ -8,6 +8,36 @@
 # NOTE           : 
 ###########################################################################
 # HISTORY        : 
+#                : Version 2.3 2026-10-17
+#                :     - added option --types <all|type,type,..>: the services of several types are found with one query to the RR
+#                :       and stored in one pass, their spec is found from their standardid like before. A service whose standardid
+#                :       is not in spec_from_standardid is skipped
+#                : Version 2.2 2026-10-17
+#                :     - the services found in the RR are loaded into a temporary table staging with one executemany, then inserted and
+#                :       updated in table services with one statement each, in one transaction (see ingest_services).
+#                :       Options --commit-rows and --commit-secs removed
+#                : Version 2.1 2026-10-17
+#                :     - added options --log-level (default INFO instead of DEBUG), --log-levels <module=LEVEL,..> and --log-max (see logqueue.py)
+#                : Version 2.0 2026-10-17
+#                :     - using db.py v 1.6: the statistics of the SQL statements are logged at the end
+#                : Version 1.9 2026-10-17
+#                :     - using db.py v 1.5: added option --db-profile (default wal)
+#                : Version 1.8 2026-10-17
+#                :     - using db.py v 1.4: the migrations of the schema are applied once the tables are created: covering index of the
+#                :       services to validate, conversion of the former errors tables (errors, error_refs) and view errors, which were
+#                :       done by create_table_errors
+#                : Version 1.7 2026-10-17
+#                :     - the errors are stored as intervals of dates in table error_intervals (first_seen, last_seen) instead of one row
+#                :       per validation date in table error_refs, which is converted. The dates when errors were found for a service are
+#                :       kept in table error_dates, the view errors gives the errors of each of these dates like the former table
+#                : Version 1.6 2026-10-17
+#                :     - the errors are stored in tables messages (each msg and section once) and error_refs (the other columns
+#                :       and the msg_id of the message), errors is now a view joining them. An existing errors table is converted
+#                : Version 1.5 2026-10-17
+#                :     - the unique index of table errors is named errors_pk: named pk like the one of table services, it was never created.
+#                :       The duplicate errors are removed (the last one is kept) before it is created
+#                : Version 1.4 2026-10-17
+#                :     - using db.py v 1.3: services are written in batches of transactions, see options --commit-rows and --commit-secs
 #                : Version 1.3 2018-04-18 
 #                :     - identify SIAv2 services with the standardid pattern standard_id LIKE 'ivo://ivoa.net/std/sia#query-%2.%' (first % is to match a possible aux capability)
 #                : Version 1.2 2018-04-16 
@@ -27,12 +57,14 @@ import os
 import getopt
 import logging
 import db # my db module
+import logqueue # my logging functions
 import val # my val module/program
 import datetime
 
 
 import pyvo as vo
 from time import sleep
+import time
 
 
 # correspondance between our service types (as in the RR's standard_ids) and the service type for searching the RR with search()
@@ -136,35 +168,193 @@ def create_table_services(conn):
   
 def create_table_errors(conn):
     """
-    create the errors table if it does not exist
+    create the errors tables if they do not exist: the messages (msg and section) are stored once in table messages and
+    referenced by the rows of table error_intervals, which give the dates when each error was found. The view errors joins them
+    with the dates of table error_dates, it has the columns and rows of the former errors table (one row per error and date).
+    The view and the conversion of the former errors tables are migrations of db.py, applied once these tables exist
     """
     
     # NB: the comments are kept by sqlite3 and can be accessed with command ".schema"
     query_create = """
-        CREATE TABLE IF NOT EXISTS errors ( 
+        CREATE TABLE IF NOT EXISTS messages ( 
+             msg_id INTEGER PRIMARY KEY  /* hash of msg and section, see db.message_id */
+            ,msg TEXT                    /* error msg - verbose - for taplint */
+            ,section TEXT                /* error section - for taplint */
+        )
+    """
+    cur_create = db.execute_db(conn, query_create, [], True)
+    
+    query_create = """
+        CREATE TABLE IF NOT EXISTS error_intervals ( 
              id TEXT NOT NULL            /* resource ivoid */
             ,url TEXT NOT NULL           /* access URL */
-            ,date TEXT                   /* validation date */
             ,type TEXT                   /* error type ex: "error" "warning" "fatal" */
             ,num INT                     /* error number (there can be several errors with the same name) */
             ,name TEXT                   /* error name ex: "4.3.2" */
-            ,msg TEXT                    /* error msg - verbose - for taplint */
-            ,section TEXT                /* error section - for taplint */
+            ,msg_id INT                  /* error msg and section, in table messages */
+            ,first_seen TEXT             /* date of the first validation which found the error */
+            ,last_seen TEXT              /* date of the last validation which found it, all the validations in between found it */
         )
     """
+    cur_create = db.execute_db(conn, query_create, [], True)
+    
+    # val.py relies on this index to insert the errors with INSERT OR REPLACE
+    query_create_index = """
+        CREATE UNIQUE INDEX IF NOT EXISTS error_intervals_pk ON error_intervals (id,url,type,num,name,msg_id,first_seen)
+    """
+    cur_create_index = db.execute_db(conn, query_create_index, [], True)
+    
+    # covering index for the errors of the last validation of a service (val.store_errors)
+    query_create_index = """
+        CREATE INDEX IF NOT EXISTS error_intervals_current ON error_intervals (id,url,last_seen,type,num,name,msg_id)
+    """
+    cur_create_index = db.execute_db(conn, query_create_index, [], True)
     
-   
+    query_create = """
+        CREATE TABLE IF NOT EXISTS error_dates ( 
+             id TEXT NOT NULL            /* resource ivoid */
+            ,url TEXT NOT NULL           /* access URL */
+            ,date TEXT NOT NULL          /* date of a validation which found errors for the service */
+        )
+    """
     cur_create = db.execute_db(conn, query_create, [], True)
-    #conn.commit() # no need, db.execute_db does it 
     
     query_create_index = """
-        CREATE UNIQUE INDEX IF NOT EXISTS pk ON errors (id,url,date,type,num,name)
+        CREATE UNIQUE INDEX IF NOT EXISTS error_dates_pk ON error_dates (id,url,date)
     """
+    cur_create_index = db.execute_db(conn, query_create_index, [], True)
     
+    # for the readers of the view errors asking for the errors of all the services of a date
+    query_create_index = """
+        CREATE INDEX IF NOT EXISTS error_dates_date ON error_dates (date)
+    """
     cur_create_index = db.execute_db(conn, query_create_index, [], True)
-    #conn.commit() # no need, db.execute_db does it 
-            
-         
+
+
+# columns of table services set from the registry, in the order of service_row() (id and url first)
+registry_columns = ["id","url","date_update","vor_created","vor_updated","vor_status","provenance","standard_id","title","short_name"
+                    ,"contact_name","contact_email","xsi_type","spec","specv","params"]
+
+
+def service_row(service, date_s):
+    """
+    :param service: service found in the RR by search()
+    :param date_s: date of today
+    :return: values of the registry_columns for the service
+    """
+    # Extract the part before the # in the standardid and the fragment (#something at the end of the standard id)
+    standardid = service.standard_id # in lowercase in the RR
+    index_pound = standardid.find('#') # index of char '#' in standardid
+    #logging.debug("index_pound=%d",index_pound)
+    fragment=None
+    if(index_pound!=-1): # pound found, copy only the part before the pound
+        standardid_substring = standardid[:index_pound]
+        fragment = standardid[index_pound:]
+    else: # no pound found, copy the entire string
+        standardid_substring = standardid
+
+    logging.debug("Found standardid_substring=%s",standardid_substring)
+    logging.debug("Found fragment=%s",fragment)
+
+    spec=spec_from_standardid[standardid_substring]
+    logging.debug("Found spec=%s",spec)
+
+    # Try to extract version of std used by service
+    # NB (per Markus after discussion in Santiago 2017-10)
+    # => the correct way is to check the end of standardid then if no version found, std_version
+
+
+    logging.debug("Determining spec version")
+    specv=None
+    if(fragment!=None): # if a fragment was found, extract the spec from the fragment
+        logging.debug("standardid's fragment found")
+        specv_from_fragment = fragment[7:] # extract "2.0" from "#query-2.0" => skip "#query-"
+        logging.debug("Found specv_from_fragment=%s",specv_from_fragment)
+        if(specv_from_fragment.replace(".", "", 1).isdigit()): # https://stackoverflow.com/questions/4138202/using-isdigit-for-floats
+            logging.debug("specv_from_fragment can convert to float => using it")
+            specv = specv_from_fragment
+    
+    if(specv==None): # version not found in fragment
+        logging.debug("No standardid's fragment found or version not found in fragment, checking std_version=%s",service['std_version'])
+        if(service['std_version']!=""):
+            logging.debug("std_version not empty, using it")
+            specv=service['std_version']
+        else: # if not found, use default version for this standard
+            logging.debug("std_version empty, using default specv from standardid")
+            specv=default_specv_from_standardid[standardid_substring]
+
+    logging.info("Found specv=%s",specv)
+
+    # default params for validation are extracted from the array val.validatorParams (in vla.py)
+    if((spec=="Simple Image Access") and (specv=="2.0")): # for SIAv2 we need this case
+        params = validatorParams[spec+" "+specv]
+    else:
+        params = validatorParams[spec]
+
+    # if some attributes are void string "" then set them to N/A
+    role_name = service['role_name']
+    if(role_name==""):
+        role_name="N/A"
+
+    email = service['email']
+    if(email==""):
+        email="N/A"
+    
+    return (service.ivoid, service.access_url
+        ,date_s # date_update
+        ,service['created'] # must be accessed like this and not by property because property not exposed in class RegistryResource
+        ,service['updated'] # idem etc.
+        ,'active' # we assume that if a service was found in the RR, it is active. Reason:
+        # See http://ivoa.net/documents/RegTAP/20171206/WD-RegTAP-1.1-20171206.html
+        # "The status attribute of vr:Resource is considered an implementation detail of the XML serialization and is not kept here. 
+        # Neither inactive nor deleted records may be kept in the resource table. Since all other tables in the relational registry should keep 
+        # a foreign key on the ivoid column, this implies that only metadata on active records is being kept in the relational registry. 
+        # In other words, users can expect a resource to exist and work if they find it in a relational registry"
+        ,service['harvested_from'] # the provenance registry's ivoid
+        ,standardid # the standardid
+        ,service.res_title
+        ,service.short_name
+        ,role_name # contact name
+        ,email # contact email
+        ,service['intf_type'] # per the search() function's implementation this should always be 'vs:paramhttp'
+        ,spec
+        ,specv
+        ,params)
+
+
+def ingest_services(conn, rows, date_s):
+    """
+    insert or update the services found in the RR, in one transaction: the rows are loaded into the temporary table staging
+    with one executemany, then the new services are inserted and all of them updated with one statement each
+    :param conn: sqlite3 connection object
+    :param rows: values of the registry_columns of each service (see service_row)
+    :param date_s: date of today, date_insert of the new services
+    :return: (nb of services staged, nb of new services)
+    """
+    columns = ",".join(registry_columns)
+    
+    with db.transaction(conn):
+        db.execute_db(conn, "CREATE TEMP TABLE IF NOT EXISTS staging ("+columns+")", [], True)
+        # a service found twice in the RR gets the values of its last row, like when the services were updated one by one
+        db.execute_db(conn, "CREATE UNIQUE INDEX IF NOT EXISTS temp.staging_pk ON staging (id,url)", [], True)
+        db.execute_db(conn, "DELETE FROM staging", [], True)
+        db.executemany_db(conn, "INSERT OR REPLACE INTO staging ("+columns+") VALUES ("+",".join(["?"]*len(registry_columns))+")", rows, True)
+        nb_staged = db.execute_db(conn, "SELECT count(*) FROM staging", [], True).fetchone()[0]
+        
+        # the services not in the DB yet (unique index pk on id,url)
+        cur = db.execute_db(conn, "INSERT OR IGNORE INTO services (id,url,date_insert) SELECT id,url,? FROM staging", [date_s], True)
+        nb_new = max(cur.rowcount,0)
+        
+        # NB: correlated subqueries instead of UPDATE ... FROM, which needs sqlite 3.33
+        query_update = "UPDATE services SET " + ",".join(["%s = (SELECT s.%s FROM staging s WHERE s.id = services.id AND s.url = services.url)" % (c, c)
+                                                           for c in registry_columns[2:]]) \
+                       + " WHERE EXISTS (SELECT 1 FROM staging s WHERE s.id = services.id AND s.url = services.url)"
+        db.execute_db(conn, query_update, [], True)
+        
+        db.execute_db(conn, "DELETE FROM staging", [], True)
+    
+    return (nb_staged, nb_new)
+
 
 # rewrite of pyvo.registry.regtap.search() for our purpose
 def search(baseurl=None,servicetype=None):
@@ -173,8 +363,8 @@ def search(baseurl=None,servicetype=None):
     Parameters
     ----------
 
-    servicetype : str
-       the service type to restrict results to.
+    servicetype : str or list of str
+       the service type(s) to restrict results to, several types are found with one query.
        Allowed values include
        'conesearch', 
        'sia' ,
@@ -202,14 +392,21 @@ def search(baseurl=None,servicetype=None):
     wheres = list()
     
     
-    
-    if(servicetype=='siav2'): # identify SIAv2 services: ivo://ivoa.net/std/sia#query-[aux]-2.X
-        wheres.append("standard_id LIKE 'ivo://ivoa.net/std/sia#query-%2.%'") # filter the SIAv2 services
-    elif (servicetype=='sia'): # make sure we identify only SIA and not SIAv2 services
-        wheres.append("standard_id LIKE 'ivo://ivoa.net/std/sia%'")
-        wheres.append("standard_id NOT LIKE 'ivo://ivoa.net/std/sia#query-%2.%'") # filter out the SIAv2 services
+    if(isinstance(servicetype,basestring)):
+        servicetypes = [servicetype]
     else:
-        wheres.append("standard_id LIKE 'ivo://ivoa.net/std/{}%'".format(vo.tap.escape(servicetype)))
+        servicetypes = servicetype
+    
+    type_wheres = list() # conditions for each service type, the services of any of them are found
+    for servicetype in servicetypes:
+        if(servicetype=='siav2'): # identify SIAv2 services: ivo://ivoa.net/std/sia#query-[aux]-2.X
+            type_wheres.append("standard_id LIKE 'ivo://ivoa.net/std/sia#query-%2.%'") # filter the SIAv2 services
+        elif (servicetype=='sia'): # make sure we identify only SIA and not SIAv2 services
+            type_wheres.append("(standard_id LIKE 'ivo://ivoa.net/std/sia%'"
+                               " AND standard_id NOT LIKE 'ivo://ivoa.net/std/sia#query-%2.%')") # filter out the SIAv2 services
+        else:
+            type_wheres.append("standard_id LIKE 'ivo://ivoa.net/std/{}%'".format(vo.tap.escape(servicetype)))
+    wheres.append("("+" OR ".join(type_wheres)+")")
     
     wheres.append("base_role = 'contact'") # added 2018-04-16 => avoid duplicate lines because of several res_role, keep only the one with base_role='contact'
     wheres.append("intf_type = 'vs:paramhttp'")
@@ -236,7 +433,7 @@ def usage():
     '''
     display this program's usage
     '''
-    print("Usage: %s -h --type <service_type> --db <db_file> --log <log_file>" % sys.argv[0])
+    print("Usage: %s -h --type <service_type> --types <all|service_type,service_type,..> --db <db_file> --db-profile <default|wal|bulk> --log <log_file> --log-level <level> --log-levels <module=level,..> --log-max <nb_chars>" % sys.argv[0])
     return
 
 def main(argv):
@@ -247,16 +444,20 @@ def main(argv):
     
     
     
-    program_version="1.3"
+    program_version="2.3"
     #global logger
     
     # Read program arguments
-    service_type=None # no default
+    service_type_list=None # types of the services to look for, no default
     db_file=None # no default
+    db_profile="wal" # performance profile of the DB connection, see db.profiles
     log_file=None # no default
+    log_level=logging.INFO # level of the log, see also log_levels
+    log_levels={} # level of the log for some modules (name of their .py file), ex: {"db":logging.DEBUG}
+    log_max=2000 # the messages of the log are truncated after log_max characters (0 = no limit)
     
     try:
-        opts, args = getopt.getopt(argv,"h",["type=","db=","log="])
+        opts, args = getopt.getopt(argv,"h",["type=","types=","db=","db-profile=","log=","log-level=","log-levels=","log-max="])
     except getopt.GetoptError as err:
         print str(err)
         usage()
@@ -267,20 +468,53 @@ def main(argv):
             usage()
             sys.exit(0)
         elif o in ("--type"):
-            service_type = a
+            service_type_list = [a]
+        elif o in ("--types"):
+            if(a=="all"):
+                service_type_list = sorted(service_types)
+            else:
+                service_type_list = a.split(",")
         elif o in ("--db"):
             db_file = a
+        elif o in ("--db-profile"):
+            if(a not in db.profiles):
+                print("ERROR: db profile must be one of %s" % ", ".join(sorted(db.profiles)))
+                usage()
+                sys.exit(2)
+            db_profile = a
         elif o in ("--log"):
             log_file = a
+        elif o in ("--log-level"):
+            try:
+                log_level = logqueue.parse_level(a)
+            except ValueError as err:
+                print str(err)
+                usage()
+                sys.exit(2)
+        elif o in ("--log-levels"):
+            try:
+                log_levels = logqueue.parse_levels(a)
+            except ValueError as err:
+                print("ERROR: log levels must be given as module=LEVEL,module=LEVEL (%s)" % err)
+                usage()
+                sys.exit(2)
+        elif o in ("--log-max"):
+            log_max = int(a)
         else:
             assert False, "unhandled option"
 
         
         
-    if(service_type==None):
+    if(service_type_list==None):
         print('ERROR: No service_type')
         usage()
         exit(2)
+    
+    for service_type in service_type_list:
+        if(service_type not in service_types):
+            print("ERROR: service_type must be one of %s" % ", ".join(sorted(service_types)))
+            usage()
+            exit(2)
         
     if(db_file==None):
         print('ERROR: No db_file')
@@ -306,8 +540,9 @@ def main(argv):
     
     
     
-    logging.basicConfig(format='%(asctime)s %(filename)s %(levelname)s %(lineno)d %(processName)s %(funcName)s: %(message)s'
-                        , level=logging.DEBUG, filename=log_file)
+    # only one process: no queue
+    logqueue.setup(log_file,'%(asctime)s %(filename)s %(levelname)s %(lineno)d %(processName)s %(funcName)s: %(message)s'
+                   ,log_level,log_levels,log_max,False)
 
     # Add colors - from https://stackoverflow.com/questions/384076/how-can-i-color-python-logging-output
     logging.addLevelName( logging.WARNING, "\033[1;31m%s\033[1;0m" % logging.getLevelName(logging.WARNING))
@@ -318,167 +553,60 @@ def main(argv):
     logging.info("This is query-rr.py version %s. argv=%s",program_version,argv)
     
     # Try to open the DB file,
-    conn = db.open_db(db_file)
+    conn = db.open_db(db_file,db_profile)
     # create the tables if they don't exist
     create_table_services(conn)
     create_table_errors(conn)
+    db.migrate(conn) # the migrations postponed until the tables exist
     
     
     # URL of RR to use
     url_rr="http://voparis-rr.obspm.fr/tap"
     
-    # Look for services with type service_type in the RR
-    logging.debug("Looking for services with type=%s in RR=%s",service_type,url_rr)
-    services = search(baseurl=url_rr,servicetype=service_types[service_type])
+    # Look for services with types service_type_list in the RR, with one query
+    logging.debug("Looking for services with types=%s in RR=%s",",".join(service_type_list),url_rr)
+    services = search(baseurl=url_rr,servicetype=[service_types[service_type] for service_type in service_type_list])
 
     # Get nb of services found
     nb_services = len(services)
 
     logging.debug("Nb of services found=%d",nb_services)
     
+    # get today's date in format 2017-12-21 
+    date_today = datetime.datetime.today()
+    date_today_s=date_today.strftime('%Y-%m-%d')
+    
+    rows = []
     s=0
     for service in services:
         s=s+1
         logging.info("Processing service %d/%d ivoid=%s url=%s standardid=%s",s,nb_services,service.ivoid,service.access_url,service.standard_id)
-        
+    
         if(False): # display all service attributes
             for a in service:
                 logging.debug("%s: %s",a,service[a])
         
-        # get today's date in format 2017-12-21 
-        date_today = datetime.datetime.today()
-        date_today_s=date_today.strftime('%Y-%m-%d')
-            
-        # Check if the service exists in the DB
-        query = """
-        SELECT count(*) FROM services WHERE id=? and url=?
-        """
-        cur = db.execute_db(conn, query, (service.ivoid, service.access_url), True)
-        nb_such_service = cur.fetchone()[0] 
-        #logging.debug("Nb of such service found in the DB=%d",nb_such_service)
-        
-        
-        
-        if(nb_such_service==0): # service does not exist in the DB yet => insert it
-                logging.debug("No such service found in the DB, inserting it")
-                
-                query_insert = """
-                INSERT INTO services (id,url,date_insert) 
-                VALUES (?, ?, ?)
-                """
-                cur_insert = db.execute_db(conn,query_insert,(service.ivoid, service.access_url, date_today_s))
-                #conn.commit() # because INSERT # no need, db.execute_db does it 
-        
-        
+        try:
+            rows.append(service_row(service, date_today_s))
+        except KeyError as e: # the services of all the types are stored together, one unknown standardid must not stop them
+            logging.warning("Unknown standardid %s, service ivoid=%s url=%s skipped",e,service.ivoid,service.access_url)
+    
+    specs = {}
+    for row in rows:
+        specs[row[registry_columns.index("spec")]] = specs.get(row[registry_columns.index("spec")],0)+1
+    for spec in sorted(specs):
+        logging.info("%d services with spec=%s",specs[spec],spec)
+    
+    # the services are written in one transaction
+    t_start = time.time()
+    (nb_staged, nb_new) = ingest_services(conn, rows, date_today_s)
+    db.checkpoint(conn)
+    logging.info("%d services stored (%d new) in %.3f secs",nb_staged,nb_new,time.time()-t_start)
     
-        # Update the service with data from registry
-        if(True):
-            
-            # Extract the part before the # in the standardid and the fragment (#something at the end of the standard id)
-            standardid = service.standard_id # in lowercase in the RR
-            index_pound = standardid.find('#') # index of char '#' in standardid
-            #logging.debug("index_pound=%d",index_pound)
-            fragment=None
-            if(index_pound!=-1): # pound found, copy only the part before the pound
-                standardid_substring = standardid[:index_pound]
-                fragment = standardid[index_pound:]
-            else: # no pound found, copy the entire string
-                standardid_substring = standardid
-                
-            logging.debug("Found standardid_substring=%s",standardid_substring)
-            logging.debug("Found fragment=%s",fragment)
-            
-            spec=spec_from_standardid[standardid_substring]
-            logging.debug("Found spec=%s",spec)
-            
-            # Try to extract version of std used by service
-            # NB (per Markus after discussion in Santiago 2017-10)
-            # => the correct way is to check the end of standardid then if no version found, std_version
-            
-            
-            logging.debug("Determining spec version")
-            specv=None
-            if(fragment!=None): # if a fragment was found, extract the spec from the fragment
-                logging.debug("standardid's fragment found")
-                specv_from_fragment = fragment[7:] # extract "2.0" from "#query-2.0" => skip "#query-"
-                logging.debug("Found specv_from_fragment=%s",specv_from_fragment)
-                if(specv_from_fragment.replace(".", "", 1).isdigit()): # https://stackoverflow.com/questions/4138202/using-isdigit-for-floats
-                    logging.debug("specv_from_fragment can convert to float => using it")
-                    specv = specv_from_fragment
-                    
-            if(specv==None): # version not found in fragment
-                logging.debug("No standardid's fragment found or version not found in fragment, checking std_version=%s",service['std_version'])
-                if(service['std_version']!=""):
-                    logging.debug("std_version not empty, using it")
-                    specv=service['std_version']
-                else: # if not found, use default version for this standard
-                    logging.debug("std_version empty, using default specv from standardid")
-                    specv=default_specv_from_standardid[standardid_substring]
-                
-            logging.info("Found specv=%s",specv)
-                
-            # default params for validation are extracted from the array val.validatorParams (in vla.py)
-            if((spec=="Simple Image Access") and (specv=="2.0")): # for SIAv2 we need this case
-                params = validatorParams[spec+" "+specv]
-            else:
-                params = validatorParams[spec]
-            
-            # if some attributes are void string "" then set them to N/A
-            role_name = service['role_name']
-            if(role_name==""):
-                role_name="N/A"
-                
-            email = service['email']
-            if(email==""):
-                email="N/A"
-            
-            query_update = """
-                UPDATE services SET 
-                 date_update = ?
-                ,vor_created = ?
-                ,vor_updated = ?
-                ,vor_status = ?
-                ,provenance = ?
-                ,standard_id = ?
-                ,title = ?
-                ,short_name = ?
-                ,contact_name = ?
-                ,contact_email = ?
-                ,xsi_type = ?
-                ,spec = ?
-                ,specv = ?
-                ,params = ?
-                WHERE id=? AND url=?
-                """
-            logging.info("Updating table services for service")
-            
-            cur_update = db.execute_db(conn,query_update,[date_today_s
-                ,service['created'] # must be accessed like this and not by property because property not exposed in class RegistryResource
-                ,service['updated'] # idem etc.
-                ,'active' # we assume that if a service was found in the RR, it is active. Reason:
-                # See http://ivoa.net/documents/RegTAP/20171206/WD-RegTAP-1.1-20171206.html
-                # "The status attribute of vr:Resource is considered an implementation detail of the XML serialization and is not kept here. 
-                # Neither inactive nor deleted records may be kept in the resource table. Since all other tables in the relational registry should keep 
-                # a foreign key on the ivoid column, this implies that only metadata on active records is being kept in the relational registry. 
-                # In other words, users can expect a resource to exist and work if they find it in a relational registry"
-                ,service['harvested_from'] # the provenance registry's ivoid
-                ,standardid # the standardid
-                ,service.res_title
-                ,service.short_name
-                ,role_name # contact name
-                ,email # contact email
-                ,service['intf_type'] # per the search() function's implementation this should always be 'vs:paramhttp'
-                ,spec
-                ,specv
-                ,params
-                ,service.ivoid, service.access_url])
-                   
-            #conn.commit() # because UPDATE # no need, db.execute_db does it 
-        # if True    
-
     # at the end, close the DB connection
     logging.info("Done. Closing connection")
     conn.close()
+    db.log_query_stats()
      
     
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : report.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : Performance report of the runs of val.py from table timings: slowest validations and hosts, percentiles per spec
+# NOTE           : the timings are stored by val.py v4.0 for each validation (services with the same URL, spec and params are
+#                : validated together), see db.migrations for the meaning of the columns
+###########################################################################
+# HISTORY        :
+#                : Version 1.0
+#                :    - Created: 2026-10-17 to find where the time of the nightly run goes
+###########################################################################
+
+import sys
+import getopt
+import logging
+import db # my db module
+import val # my val module/program
+
+
+# outcomes of the validations which gave results
+ok_outcomes = ("ok","partial","stored")
+
+# phases of a validation (columns of table timings) shown in the reports
+phases = ["connect_secs","ttfb_secs","read_secs","parse_secs","db_secs","total_secs"]
+
+
+def get_runs(conn):
+    '''
+    :param conn: sqlite3 connection object
+    :return: list of (run, nb of validations), last run first
+    '''
+    cur = db.execute_db(conn, "SELECT run, count(*) FROM timings GROUP BY run ORDER BY run desc", [], True)
+    return cur.fetchall()
+
+
+def get_timings(conn, run):
+    '''
+    :param conn: sqlite3 connection object
+    :param run: run of val.py, None for all the runs
+    :return: list of the timings of the validations of the run, as dicts with the columns of table timings
+    '''
+    query = "SELECT * FROM timings"
+    values = []
+    if(run!=None):
+        query += " WHERE run = ?"
+        values = [run]
+    cur = db.execute_db(conn, query, values, True)
+    columns = [d[0] for d in cur.description]
+    return [dict(zip(columns, row)) for row in cur]
+
+
+def print_summary(timings):
+    '''
+    print the nb of validations, services and the outcomes
+    '''
+    outcomes = {}
+    for t in timings:
+        outcomes[t["outcome"]] = outcomes.get(t["outcome"],0)+1
+    print("%d validations of %d services, %.1f secs of validation (sum), %.1f secs writing to the DB, %.1f MB of outputs"
+          % (len(timings), sum([t["nb_services"] for t in timings]), sum([t["total_secs"] for t in timings])
+             , sum([t["db_secs"] for t in timings]), sum([t["size"] for t in timings])/1048576.0))
+    print("outcomes: %s" % ", ".join(["%s=%d" % (o, n) for (o, n) in sorted(outcomes.items(), key=lambda item: -item[1])]))
+
+
+def print_slowest_validations(timings, top):
+    '''
+    print the top slowest validations with the time of each phase
+    '''
+    print("")
+    print("Slowest validations")
+    print("%9s %9s %9s %9s %9s %9s %10s %-16s %-24s %s" % ("total","connect","ttfb","read","parse","db","size","outcome","spec","url (services)"))
+    for t in sorted(timings, key=lambda t: -t["total_secs"])[:top]:
+        print("%9.3f %9.3f %9.3f %9.3f %9.3f %9.3f %10d %-16s %-24s %s (%d)" % (t["total_secs"], t["connect_secs"], t["ttfb_secs"]
+              , t["read_secs"], t["parse_secs"], t["db_secs"], t["size"], t["outcome"], t["spec"], t["url"], t["nb_services"]))
+
+
+def print_slowest_hosts(timings, top):
+    '''
+    print the top hosts of the services whose validations took the longest in total
+    '''
+    hosts = {}
+    for t in timings:
+        hosts.setdefault(t["host"],[]).append(t)
+    print("")
+    print("Slowest hosts")
+    print("%10s %7s %9s %9s %9s %8s %s" % ("total","nb","mean","p95","max","failed","host"))
+    ranked = sorted(hosts.items(), key=lambda item: -sum([t["total_secs"] for t in item[1]]))
+    for (host, host_timings) in ranked[:top]:
+        secs = [t["total_secs"] for t in host_timings]
+        nb_failed = len([t for t in host_timings if t["outcome"] not in ok_outcomes])
+        print("%10.3f %7d %9.3f %9.3f %9.3f %8d %s" % (sum(secs), len(secs), sum(secs)/len(secs), val.percentile(secs,95), max(secs), nb_failed, host))
+
+
+def print_percentiles(timings):
+    '''
+    print the percentiles of the time of each phase for each spec
+    '''
+    specs = {}
+    for t in timings:
+        specs.setdefault(t["spec"],[]).append(t)
+    print("")
+    print("Percentiles per spec (p50/p90/p99 secs)")
+    print("%-24s %7s %s" % ("spec","nb"," ".join(["%23s" % phase[:-5] for phase in phases])))
+    for spec in sorted(specs):
+        columns = []
+        for phase in phases:
+            secs = [t[phase] for t in specs[spec]]
+            columns.append("%7.3f/%7.3f/%7.3f" % (val.percentile(secs,50), val.percentile(secs,90), val.percentile(secs,99)))
+        print("%-24s %7d %s" % (spec, len(specs[spec]), " ".join(columns)))
+
+
+def usage():
+    '''
+    display this program's usage
+    '''
+    print("Usage: %s -h --db <db_file> --run <YYYY-MM-DD HH:MM:SS|last|all> --top <n> --list-runs" % sys.argv[0])
+    return
+
+
+def main(argv):
+    '''
+    main program
+    :param argv: parameters
+    '''
+
+    program_version="1.0"
+
+    db_file=None # no default
+    run="last" # run of val.py to report on, "last" or "all"
+    top=20 # nb of validations and hosts listed
+    list_runs=False # True => only list the runs
+
+    try:
+        opts, args = getopt.getopt(argv,"h",["db=","run=","top=","list-runs"])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-h"):
+            usage()
+            sys.exit(0)
+        elif o in ("--db"):
+            db_file = a
+        elif o in ("--run"):
+            run = a
+        elif o in ("--top"):
+            top = int(a)
+        elif o in ("--list-runs"):
+            list_runs = True
+        else:
+            assert False, "unhandled option"
+
+    if(db_file==None):
+        print('ERROR: No db_file')
+        usage()
+        exit(2)
+
+    # the report is printed, only the warnings and errors are logged
+    logging.basicConfig(format='%(asctime)s %(filename)s %(levelname)s: %(message)s', level=logging.WARNING)
+
+    conn = db.open_db(db_file)
+    runs = get_runs(conn)
+    if(list_runs):
+        for (r, nb) in runs:
+            print("%s %7d validations" % (r, nb))
+        conn.close()
+        return
+
+    if(not runs):
+        print("No timings in %s, they are stored by val.py v4.0" % db_file)
+        conn.close()
+        sys.exit(1)
+
+    if(run=="last"):
+        run = runs[0][0]
+    elif(run=="all"):
+        run = None
+    timings = get_timings(conn, run)
+    conn.close()
+
+    print("Run %s of val.py" % (run if run!=None else "all the runs"))
+    if(not timings):
+        print("No timings for this run, see --list-runs")
+        sys.exit(1)
+    print_summary(timings)
+    print_slowest_validations(timings, top)
+    print_slowest_hosts(timings, top)
+    print_percentiles(timings)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
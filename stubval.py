@@ -0,0 +1,280 @@
+###########################################################################
+# SITE           : OPM
+# PROJECT        : IVOA Services Validator
+# FILE           : stubval.py
+# AUTHOR         : Renaud.Savalle@obspm.fr
+# LANGUAGE       : Python
+# DESCRIPTION    : Stand-in for the VO-Paris validators (validator.php?format=XML and tapvalidator.php?format=JSON)
+#                : to benchmark val.py without calling them, also used to generate outputs for bench-parsers.py
+# NOTE           : the outputs have the shape of the real ones (voresp XML, taplint JSON), with random contents.
+#                : Run standalone with: python stubval.py --port 8765 --latency lognormal:-2:1 ...
+###########################################################################
+# HISTORY        :
+#                : Version 1.0
+#                :    - Created: 2026-10-17 for the end-to-end benchmark bench-e2e.py
+###########################################################################
+
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import urlparse
+import random
+import json
+import time
+import math
+import sys
+import getopt
+import logging
+
+
+# default behaviour of the stand-in validators, see usage() for the meaning of each one
+default_settings = {
+     "latency"          : "const:0.05"  # distribution of the time before answering, in secs
+    ,"reports"          : "const:10"    # distribution of the nb of reports (warnings, errors...) per output
+    ,"text_size"        : 80            # size of the text of each report, in bytes
+    ,"error_rate"       : 0.0           # fraction of the requests answered with HTTP 500
+    ,"hang_rate"        : 0.0           # fraction of the requests not answered during hang_secs
+    ,"hang_secs"        : 60.0
+    ,"slow_rate"        : 0.0           # fraction of the outputs sent slowly, in small pieces during slow_secs
+    ,"slow_secs"        : 30.0
+    ,"truncate_rate"    : 0.0           # fraction of the TAP outputs cut in the middle, like when taplint times out
+    ,"seed"             : 0
+}
+
+
+# codes of the sections of taplint
+tap_sections = ["TMV","TME","TMS","TMC","CPV","CAP","AVV","QGE","QPO","QAS","UWS","MDQ","OBS","UPL","EXA"]
+
+# levels of the taplint reports, with their weight
+tap_levels = [("INFO",5),("WARNING",3),("ERROR",2),("FAILURE",1),("SUMMARY",1)]
+
+# types of the DAL validator reports
+dal_types = ["warning","warning","warning","error","error","fatal"]
+
+
+def distribution(desc, rng):
+    '''
+    :param desc: distribution as "const:<v>", "uniform:<min>:<max>", "exp:<mean>" or "lognormal:<mu>:<sigma>"
+    :param rng: random.Random object
+    :return: function returning a random value from the distribution
+    '''
+    parts = desc.split(":")
+    name = parts[0]
+    args = [float(a) for a in parts[1:]]
+    if(name=="const"):
+        return lambda: args[0]
+    elif(name=="uniform"):
+        return lambda: rng.uniform(args[0], args[1])
+    elif(name=="exp"):
+        return lambda: rng.expovariate(1.0/args[0]) if args[0]>0 else 0.0
+    elif(name=="lognormal"):
+        return lambda: rng.lognormvariate(args[0], args[1])
+    else:
+        raise ValueError("Unknown distribution %s" % desc)
+
+
+def text(rng, size):
+    '''
+    :return: random text of size bytes, looking like a message of the validators
+    '''
+    words = ["column","table","VOTable","value","invalid","missing","UCD","unit","datatype","query","should","must","be","not"]
+    s = ""
+    while(len(s)<size):
+        s += rng.choice(words)+" "
+    return s[:size]
+
+
+def tap_output(nb_reports, rng=None, text_size=80):
+    '''
+    generate a taplint JSON output: {"sections":[{"code":..,"title":..,"reports":[{"level":..,"code":..,"text":..},..]},..],"totals":{..}}
+    :param nb_reports: nb of reports, of all levels
+    :param rng: random.Random object (None = random.Random(0))
+    :param text_size: size of the text of each report
+    :return: JSON string
+    '''
+    if(rng==None):
+        rng = random.Random(0)
+    levels = []
+    for (level, weight) in tap_levels:
+        levels += [level]*weight
+
+    sections = []
+    totals = {}
+    nb_sections = min(len(tap_sections), max(1, nb_reports//10))
+    for i in range(nb_sections):
+        reports = []
+        for j in range(nb_reports//nb_sections + (1 if i<nb_reports%nb_sections else 0)):
+            level = rng.choice(levels)
+            totals[level] = totals.get(level,0)+1
+            reports.append({"level":level, "code":"%s%d" % (level[0], rng.randint(1,40)), "text":text(rng, text_size)})
+        sections.append({"code":tap_sections[i], "title":"Section %s" % tap_sections[i], "reports":reports})
+    return json.dumps({"sections":sections, "totals":totals})
+
+
+def dal_output(spec, nb_reports, rng=None, text_size=80):
+    '''
+    generate a VO-Paris DAL validator XML output: <voresp><valid spec=..>yes|no</valid>..<warning name=..>html</warning>..</voresp>
+    :param spec: specification of the service
+    :param nb_reports: nb of warnings, errors and fatals
+    :param rng: random.Random object (None = random.Random(0))
+    :param text_size: size of the text of each report
+    :return: XML string
+    '''
+    if(rng==None):
+        rng = random.Random(0)
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<voresp xmlns="http://voparis-validator.obspm.fr/">\n']
+    parts.append('<valid spec="VOTable">%s</valid>\n' % rng.choice(["yes","no"]))
+    parts.append('<valid spec="%s">%s</valid>\n' % (spec, rng.choice(["yes","no"])))
+    for i in range(nb_reports):
+        type = rng.choice(dal_types)
+        parts.append('<%s name="%d.%d"><div xmlns="http://www.w3.org/1999/xhtml"><p>%s</p></div></%s>\n'
+                     % (type, rng.randint(1,8), rng.randint(1,20), text(rng, text_size), type))
+    parts.append('</voresp>\n')
+    return "".join(parts)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    answer the requests to validator.php and tapvalidator.php
+    '''
+    protocol_version = "HTTP/1.1" # keep-alive, like the real validators
+
+    def do_GET(self):
+        server = self.server
+        settings = server.settings
+        rng = server.rng
+        parts = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(parts.query)
+
+        time.sleep(max(0.0, server.latency()))
+
+        if(rng.random()<settings["hang_rate"]):
+            time.sleep(settings["hang_secs"])
+            self.close_connection = 1
+            return
+
+        if(rng.random()<settings["error_rate"]):
+            self.send_error(500, "Stand-in validator error")
+            return
+
+        nb_reports = max(0, int(server.reports()))
+        spec = query.get("spec",[""])[0].rsplit(" ",1)[0] # without the version
+        if(parts.path.endswith("tapvalidator.php")):
+            body = tap_output(nb_reports, rng, settings["text_size"])
+            if(rng.random()<settings["truncate_rate"]):
+                body = body[:len(body)//2]
+        else:
+            body = dal_output(spec, nb_reports, rng, settings["text_size"])
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if(rng.random()<settings["slow_rate"]):
+            pieces = 100
+            size = int(math.ceil(len(body)/float(pieces)))
+            for i in range(0, len(body), size):
+                self.wfile.write(body[i:i+size])
+                self.wfile.flush()
+                time.sleep(settings["slow_secs"]/pieces)
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    HTTP server with one thread per connection
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, port, settings={}):
+        '''
+        :param port: port to listen to on 127.0.0.1 (0 = any free port, see server_address)
+        :param settings: see default_settings
+        '''
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", port), Handler)
+        self.settings = dict(default_settings)
+        self.settings.update(settings)
+        self.rng = random.Random(self.settings["seed"])
+        self.latency = distribution(self.settings["latency"], self.rng)
+        self.reports = distribution(self.settings["reports"], self.rng)
+
+    def handle_error(self, request, client_address):
+        '''
+        the clients close the connection when their deadline passes (hang, slow outputs): not an error of the server
+        '''
+        logging.debug("Connection with %s closed by the client: %s", client_address, sys.exc_info()[1])
+
+    def url(self):
+        '''
+        :return: base URL of the stand-in validators, to give to val.py --validator-url
+        '''
+        return "http://%s:%d/" % self.server_address
+
+
+def start(port=0, settings={}):
+    '''
+    start a stand-in validator server in a thread
+    :return: Server object, stop it with shutdown()
+    '''
+    server = Server(port, settings)
+    t = threading.Thread(target=server.serve_forever, name="StubValidator")
+    t.daemon = True
+    t.start()
+    return server
+
+
+def usage():
+    '''
+    print usage
+    '''
+    print("Usage: %s -h --port <port> --latency <distribution> --reports <distribution> --text-size <bytes> --error-rate <f> --hang-rate <f> --hang-secs <secs> --slow-rate <f> --slow-secs <secs> --truncate-rate <f> --seed <n>" % sys.argv[0])
+    print("distribution: const:<v> uniform:<min>:<max> exp:<mean> lognormal:<mu>:<sigma>, rates are fractions of the requests (0 to 1)")
+
+
+def main(argv):
+    '''
+    main program: run the stand-in validators until interrupted
+    :param argv: parameters
+    '''
+    port = 8765
+    settings = {}
+    names = ["latency","reports","text-size","error-rate","hang-rate","hang-secs","slow-rate","slow-secs","truncate-rate","seed"]
+    try:
+        opts, args = getopt.getopt(argv,"h",["port="]+[name+"=" for name in names])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o in ("-h"):
+            usage()
+            sys.exit(0)
+        elif o in ("--port"):
+            port = int(a)
+        else:
+            key = o[2:].replace("-","_")
+            if(key in ("latency","reports")):
+                settings[key] = a
+            elif(key=="seed"):
+                settings[key] = int(a)
+            else:
+                settings[key] = float(a)
+
+    logging.basicConfig(format='%(asctime)s %(filename)s %(levelname)s %(threadName)s: %(message)s', level=logging.INFO)
+    server = Server(port, settings)
+    logging.info("Stand-in validators listening on %s with %s", server.url(), server.settings)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
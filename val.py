@@ -10,6 +10,93 @@
 # TODO           :
 #                : [] 2017-10-05 update services.params in SQL db (currently only set once by db-import-vop.php/query-vop.py)
 # HISTORY        : 
+#                : Version 4.1 2026-10-17
+#                :     - the processes log through a queue to a listener process, the only one writing to the log file (logqueue.py).
+#                :       Added options --log-level (default INFO instead of DEBUG), --log-levels <module=LEVEL,..> and --log-max
+#                :       (the messages are truncated after this nb of characters). On a parsing error, the file where the output
+#                :       of the validator is kept (--cache-dir) is logged
+#                : Version 4.0 2026-10-17
+#                :     - the time spent in each phase of the validation of each service (connection, time to first byte, reading, parsing,
+#                :       writing to the DB), the size of the output and the outcome are stored in table timings (db.py v1.7) for each run,
+#                :       see report.py. Option --timings-keep gives the nb of days they are kept
+#                : Version 3.9 2026-10-17
+#                :     - using db.py v 1.6: the statistics of the SQL statements of the main process and of the writer are logged at the end
+#                : Version 3.8 2026-10-17
+#                :     - using db.py v 1.5: added option --db-profile (default wal: the readers of the DB do not block the writer)
+#                : Version 3.7 2026-10-17
+#                :     - using db.py v 1.4: the schema migrations (covering index for the services to validate, conversion of the former
+#                :       errors tables, view errors) are applied when the DB is opened
+#                :     - added option --check-plans: checks with EXPLAIN QUERY PLAN that no hot query reads a whole table. The queries
+#                :       checked are the module-level queries run by val.py (update_services_query, services_query...)
+#                : Version 3.6 2026-10-17
+#                :     - the errors are stored as intervals of dates in table error_intervals (created by query-rr.py v1.7): the errors
+#                :       found again extend the interval they got from the previous validation, so a service whose errors did not change
+#                :       costs one UPDATE. get_errors() gives the errors of a service for any date. The dates when errors were found
+#                :       for a service are kept in table error_dates, for the view errors
+#                : Version 3.5 2026-10-17
+#                :     - the errors are written to tables messages and error_refs (created by query-rr.py v1.6), each msg and section
+#                :       being stored once in messages with an id computed from them (db.message_id). errors is now a view
+#                : Version 3.4 2026-10-17
+#                :     - the errors of a service are written with one executemany INSERT OR REPLACE relying on the unique index
+#                :       errors_pk (created by query-rr.py v1.5) instead of a SELECT count(*) then an INSERT for each error.
+#                :       The errors of an earlier validation of the same day are removed first
+#                : Version 3.3 2026-10-17
+#                :     - added option --validator-url to call other validators than the VO-Paris ones (ex: stubval.py, see bench-e2e.py)
+#                :     - added option --stats: the services/s, the latency (p50, p99) of the validations and the time spent by the writer
+#                :       in the DB are written to a JSON file (they are logged anyway)
+#                : Version 3.2 2026-10-17
+#                :     - added option --replay <cache_dir>: the services still in the registry (--max-age) that have an output stored
+#                :       with --cache-dir are updated from it, without calling the validators (the --timeout must be the same, it is
+#                :       part of the TAP validator URL). They get the date of the stored output (a --cache-ttl hit gets today's date),
+#                :       the services validated after that date are not updated.
+#                :       Use --engine process with --ps to parse in parallel
+#                : Version 3.1 2026-10-17
+#                :     - added option --cache-dir: the outputs of the validators are kept compressed in this directory (archive.py),
+#                :       indexed by the validator URL. They are used instead of calling the validator during --cache-ttl hours.
+#                :       The oldest are removed at the end when the directory is bigger than --cache-size
+#                : Version 3.0 2026-10-17
+#                :     - --timeout is now a deadline for the whole validation (connection, headers, body and parsing), not only for
+#                :       each blocking socket operation. The socket timeout is set to the time left, the connection is closed when it passes
+#                :     - added option --max-size: the output of the validator is not read beyond this size (MB)
+#                :     - the nb_* cols are set to -1 if the validator does not answer in time, -2 if the connection can not be made in time
+#                :       (this case was never detected before), -3 if the output is too big
+#                : Version 2.9 2026-10-17
+#                :     - the XML output of the DAL validator is parsed in one pass with iterparse while it is read, instead of
+#                :       building the whole tree and searching it for each type of error. The XML data is not logged anymore
+#                : Version 2.8 2026-10-17
+#                :     - the JSON output of the TAP validator is parsed while it is read (jsonstream.py), without building the whole
+#                :       document. If it is truncated (timeout), the reports read so far are used instead of the default results (-1)
+#                :     - the JSON data is not logged anymore when its parsing fails
+#                : Version 2.7 2026-10-17
+#                :     - added option --schedule adaptive: the services whose results stay the same are validated less and less often
+#                :       (see adaptive_where), at least every --max-age days, --force-all validates all of them anyway
+#                :     - days_same is reset to 0 when the results of the service change, as documented in table services
+#                : Version 2.6 2026-10-17
+#                :     - the services with the same URL (once normalized), spec, spec version and params are grouped before validation: the
+#                :       validator is called once per group and the results are stored for all the services of the group with one UPDATE.
+#                :       This replaces the check of the TAP services already validated today, and the workers do not read the DB anymore.
+#                :       The services are read sorted by group (URL normalized by sqlite with normalize_url) while they are validated:
+#                :       the groups are given to the scheduler as it needs them, at most --max-pending groups wait in it. With a rollback
+#                :       journal (not WAL), the open cursor would prevent the writer from committing: all the groups are read first
+#                :     - as before, the errors of TAP services are only stored for the first service of the group
+#                : Version 2.5 2026-10-17
+#                :     - the validators are called with persistent connections from a httppool.Pool (one per worker process
+#                :       or one for all the threads) instead of urllib2, see options --pool-size and --pool-idle
+#                : Version 2.4 2026-10-17
+#                :     - the services are dispatched to the workers by a Scheduler which interleaves the hosts and limits the nb of
+#                :       validations running at the same time per validator (--max-per-validator) and per service host (--max-per-host)
+#                : Version 2.3 2026-10-17
+#                :     - added option --engine thread: the validations run in --concurrency threads of one process instead of --ps processes
+#                : Version 2.2 2026-10-17
+#                :     - the services are not split in nb_ps slices anymore (numpy no longer needed): they are read with a cursor
+#                :       (no fetchall()) and the workers take them one by one from a queue. nb_ps>nb_services is no longer an error
+#                : Version 2.1 2026-10-17
+#                :     - the workers do not write to the DB anymore, they send their results to a single writer process
+#                :       which stores them in batches of transactions, see options --commit-rows and --commit-secs.
+#                :       main checks every check_secs that the workers and the writer are alive: the service of a dead worker is
+#                :       given up and the writer is told not to wait for it. The writer stops if main is dead
+#                : Version 2.0 2026-10-17
+#                :     - using db.py v 1.3: update_service() writes the service and its errors in one transaction
 #                : Version 1.9 2018-04-18 
 #                :     - consider only services updated today, not today -2 days ago
 #                : Version 1.8 2018-04-09 
@@ -45,20 +132,27 @@ import logging
 #import colorlog
 #import coloredlogs
 import multiprocessing
+import threading
+import Queue
 import time
 import sqlite3
 import db
+import httppool
 import socket
 import sys
 #import traceback
 import getopt
 import os.path
-import numpy # for array_split
 import datetime
-import urllib2
 import urllib
+import urlparse
+import collections
 import xml.etree.cElementTree as ET
+import cStringIO
 import json
+import jsonstream
+import archive
+import logqueue
 #from threading import Timer
 
 # Global variables
@@ -76,6 +170,80 @@ validatorBaseURLs={
 #logger=None
 
 
+# main and the writer wait for the queues at most check_secs seconds before checking that the other processes are alive
+check_secs = 10
+
+
+# query to insert an error seen for the first time: the interval of dates when it is seen starts and ends at the validation date.
+# The row with the same id,url,type,num,name,msg_id,first_seen (unique index error_intervals_pk) is replaced
+insert_interval_query = """
+        INSERT OR REPLACE INTO error_intervals (id,url,type,num,name,msg_id,first_seen,last_seen) 
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+# query to keep the date of a validation which found errors for a service, the view errors gives them for these dates
+insert_error_date_query = "INSERT OR IGNORE INTO error_dates (id,url,date) VALUES (?, ?, ?)"
+
+# queries on the intervals of the errors of a service, see store_errors and get_errors
+prev_errors_query = "SELECT type,num,name,msg_id FROM error_intervals WHERE id = ? and url = ? and last_seen = ?"
+extend_intervals_query = "UPDATE error_intervals SET last_seen = ? WHERE id = ? and url = ? and last_seen = ?"
+close_interval_query = """
+        UPDATE error_intervals SET last_seen = ?
+        WHERE id = ? and url = ? and type = ? and num = ? and name = ? and msg_id = ? and last_seen = ?
+        """
+delete_interval_query = """
+        DELETE FROM error_intervals
+        WHERE id = ? and url = ? and type = ? and num = ? and name = ? and msg_id = ? and first_seen = ?
+        """
+get_errors_query = """
+        SELECT e.type, e.num, e.name, m.msg, m.section, e.first_seen, e.last_seen
+        FROM error_intervals e JOIN messages m ON m.msg_id = e.msg_id
+        WHERE e.id = ? and e.url = ? and e.first_seen <= ? and e.last_seen >= ?
+        ORDER BY e.type, e.num
+        """
+
+# date of the previous validation of a service, see update_service
+prev_date_query = "SELECT date FROM services WHERE id = ? and url = ?"
+
+# query to update the results of a service, see update_service.
+# If the results are the same as the previous ones, days_same is increased by the nb of days since the service was last
+# validated, computed by sqlite for each service from its previous date, else it is reset to 0 (also if it was never validated)
+update_services_query = """
+        UPDATE services SET 
+         days_same = CASE 
+            WHEN result_vot IS ? AND result_spec IS ? AND nb_warn IS ? AND nb_err IS ? AND nb_fatal IS ? AND nb_fail IS ?
+            THEN COALESCE(days_same,0) + CAST(julianday(?) - julianday(COALESCE(date,?)) AS INTEGER)
+            ELSE 0 END
+        ,date = ?
+        ,val_mode='normal'
+        ,result_vot=?
+        ,result_spec=?
+        ,nb_warn=?
+        ,nb_err=?
+        ,nb_fatal=?
+        ,nb_fail=? 
+        WHERE id=? AND url=?
+        """
+
+# queries to get the services to validate, see main: % the SQL condition on table services.
+# The services are sorted by group (URL normalized by normalize_url, registered as a sqlite function, spec, spec version, params)
+count_services_query = "SELECT count(*) FROM services WHERE %s"
+services_query = """
+        SELECT id,url,spec,specv,params,normalize_url(url) AS nurl FROM services WHERE %s
+        ORDER BY nurl, spec, specv, params, date_update, id, url
+        """
+
+# query to remove the timings of the old runs, see main
+delete_timings_query = "DELETE FROM timings WHERE run < ?"
+
+# query to store the timings of a validation, see new_timings and store_timings
+insert_timings_query = """
+        INSERT OR REPLACE INTO timings (run,id,url,spec,host,nb_services,outcome,http_status,size
+            ,connect_secs,ttfb_secs,read_secs,parse_secs,db_secs,total_secs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+
 def upsert_error(conn, ivoid, url, date, type, num, name, msg="", section=""):
     '''
     insert or update an error in the errors table 
@@ -90,50 +258,113 @@ def upsert_error(conn, ivoid, url, date, type, num, name, msg="", section=""):
     :param section: section for error
     '''
 
-    logging.info("Upserting error")
-    
-    # Check if the error already exists in the DB
-    # NB: this query can take a long time if no index (id,url) has been defined on table errors !
-    # => create index errors_idx on errors(id,url);
+    msg_id = db.message_id(msg, section)
+    db.insert_messages(conn,[(msg_id, msg, section)])
+    db.execute_db(conn,insert_interval_query,(ivoid, url, type, num, name, msg_id, date, date))
+    db.execute_db(conn,insert_error_date_query,(ivoid, url, date))
+        
+    return
 
 
+# types of errors in the errors table, with the key of their list in the results of parse_*_validator
+error_types = [("warning","warnings"),("error","errors"),("fatal","fatals"),("failure","fails")]
 
-    query = """
-           SELECT count(*) FROM errors
-           WHERE id = ? and url = ? and date = ? and type = ? and num = ? and name = ? and msg = ? and section = ?
-           """
-           
-    cur = db.execute_db(conn,query,(ivoid, url, date, type, num, name, msg, section))
-    
-    nb_errors = cur.fetchone()[0]
-    
-    #logging.info("nb_errors = %d",nb_errors)
 
-    if(nb_errors==0): # if the error does not already exist
-        # insert the error
+def store_errors(conn, ivoid, url, date, prev_date, results):
+    '''
+    store the errors of a service as intervals of dates: the intervals of the errors also found by the previous validation
+    are extended to the date, the new errors get a new interval. If the errors did not change, this is one UPDATE
+    :param conn: sqlite3 DB connection object
+    :param ivoid: service id
+    :param url: service url
+    :param date: date of the validation
+    :param prev_date: date of the previous validation of the service (None if never validated)
+    :param results: results object returned by parse_*_validator
+    :return: (nb of errors, nb of new errors)
+    '''
+    
+    messages = {} # msg_id -> row of table messages
+    errors = set() # (type,num,name,msg_id) of the errors found
+    for (type,key) in error_types:
+        num=0
+        for error in results[key]:
+            num=num+1
+            msg_id = db.message_id(error["msg"], error["section"])
+            messages[msg_id] = (msg_id, error["msg"], error["section"])
+            errors.add((type, num, error["name"], msg_id))
+    
+    # errors found by the previous validation: their interval ends at prev_date
+    prev_errors = set()
+    if(prev_date!=None):
+        cur = db.execute_db(conn,prev_errors_query,(ivoid, url, prev_date))
+        prev_errors = set(cur.fetchall())
+    
+    new_errors = errors - prev_errors
+    gone_errors = prev_errors - errors
+    
+    if(prev_errors and prev_date!=date):
+        # extend all the intervals, then put back those of the errors not found anymore
+        db.execute_db(conn,extend_intervals_query,(date, ivoid, url, prev_date))
+        if(gone_errors):
+            db.executemany_db(conn,close_interval_query,[(prev_date, ivoid, url)+error+(date,) for error in gone_errors])
+    elif(gone_errors):
+        # validated again the same day: the errors found only today are removed. NB: those also found the days before keep
+        # their interval, the date of the validation before is not known
+        db.executemany_db(conn,delete_interval_query,[(ivoid, url)+error+(date,) for error in gone_errors])
+    
+    if(new_errors):
+        db.insert_messages(conn,[messages[error[3]] for error in new_errors])
+        db.executemany_db(conn,insert_interval_query,[(ivoid, url)+error+(date, date) for error in new_errors])
+    
+    if(errors):
+        db.execute_db(conn,insert_error_date_query,(ivoid, url, date))
+    
+    return (len(errors), len(new_errors))
 
 
-        query = """
-                INSERT INTO errors (id,url,date,type,num,name,msg,section) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """
-   
-        cur = db.execute_db(conn,query,(ivoid, url, date, type, num, name, msg, section))
-        conn.commit() # because INSERT
-        
-    return
+def get_errors(conn, ivoid, url, date):
+    '''
+    get the errors found for a service by its validation of a date
+    :param conn: sqlite3 DB connection object
+    :param ivoid: service id
+    :param url: service url
+    :param date: date, in format 2017-05-18
+    :return: list of dicts with keys type, num, name, msg, section, first_seen and last_seen, ordered by type and num
+    '''
+    cur = db.execute_db(conn,get_errors_query,(ivoid, url, date, date))
+    keys = ["type","num","name","msg","section","first_seen","last_seen"]
+    return [dict(zip(keys,row)) for row in cur]
     
 
-def update_service(conn,ivoid,url,results):
+def update_service(conn,services,results,errors_first_only=False):
     '''
-    update the service in the sqlite3 DB
+    update in the sqlite3 DB the services validated by the same validator call
     :param conn: sqlite3 connection object
-    :param ivoid: id of the service
-    :param url: url of the service
+    :param services: list of (ivoid,url) of the services
     :param results: results object returned by parse_*_validator
+    :param errors_first_only: True => the errors are only stored for the first service (TAP services, see version 1.8)
     '''
 
-    logging.info("Updating sqlite3 db for service ivoid=%s url=%s",ivoid,url) # : %s",data)
+    # get today's date in format 2017-05-18, or the date of the output of the validator if it was stored (see validate_service)
+    date_today = datetime.datetime.today()
+    date_today_s=results.get("date",date_today.strftime('%Y-%m-%d'))
+    
+    # replay: the stored output may be older than the last validation of a service (whose output was not stored, ex: timeout).
+    # The dates of a service and of its errors only move forward: such a service is not updated
+    if("date" in results):
+        kept = []
+        for (ivoid,url) in services:
+            row = db.execute_db(conn,prev_date_query,(ivoid, url)).fetchone()
+            if(row!=None and row[0]!=None and row[0]>date_today_s):
+                logging.warning("Stored output of %s older than the last validation (%s) of service ivoid=%s url=%s. Service not updated.",
+                                date_today_s,row[0],ivoid,url)
+            else:
+                kept.append((ivoid,url))
+        services = kept
+        if(not services):
+            return
+    
+    logging.info("Updating sqlite3 db for %d services, first is ivoid=%s url=%s",len(services),services[0][0],services[0][1]) # : %s",data)
     
     #print results
     new_result_vot = results["result_vot"] 
@@ -143,126 +374,103 @@ def update_service(conn,ivoid,url,results):
     new_nb_fatal = results["nb_fatal"] 
     new_nb_fail = results["nb_fail"] 
     
-    # get today's date in format 2017-05-18 
-    date_today = datetime.datetime.today()
-    date_today_s=date_today.strftime('%Y-%m-%d')
-    
-    # Get previous results
-    
-    query = """
-            SELECT val_mode, result_vot, result_spec, nb_warn, nb_err, nb_fatal, nb_fail, date, days_same
-            FROM services
-            WHERE id=? AND url=?
-            """
-    logging.info("Getting previous results")
-    
-    cur = db.execute_db(conn, query, (ivoid, url))
-    
-    service = cur.fetchone()
-    prev_val_mode = service[0]
-    prev_result_vot = service[1]
-    prev_result_vot = service[2]
-    prev_nb_warn = service[3]
-    prev_nb_err = service[4]
-    prev_nb_fatal = service[5]
-    prev_nb_fail = service[6]
-    prev_date = service[7]
-    prev_days_same = service[8]
-    
-    # Compute days same 
-    # datetime when service was last updated
-    
-    if(prev_date==None): # if service was never validated
-        date_prev = date_today # then nb_days will be 0
-    else:
-        date_prev = datetime.datetime.strptime(prev_date,'%Y-%m-%d')
-    
-    interval = date_today-date_prev
-    
-    nb_days = interval.days
-    
-    #logging.info(interval)
-    logging.debug("The service was last updated %d days ago",nb_days)
-    
-    new_days_same = prev_days_same + nb_days
-    
-    logging.debug("Old days_same: %d New days_same: %d",prev_days_same,new_days_same)
-    
-    
-    # create query to update the service
-  
-    query = """
-            UPDATE services SET 
-             date = ?
-            ,val_mode='normal'
-            ,result_vot=?
-            ,result_spec=?
-            ,nb_warn=?
-            ,nb_err=?
-            ,nb_fatal=?
-            ,nb_fail=? 
-            ,days_same=?
-            WHERE id=? AND url=?
-            """
-
-    logging.info("Updating table services for service")
-
-    cur = db.execute_db(conn,query,[date_today_s
-               ,new_result_vot
-               ,new_result_spec
-               ,new_nb_warn
-               ,new_nb_err
-               ,new_nb_fatal
-               ,new_nb_fail 
-               ,new_days_same
-               ,ivoid, url])
-               
-    conn.commit()
-        
-    # get today's date in format 2017-05-31 
-    #date_today_s=datetime.date.today().strftime('%Y-%m-%d')
-    
-    
-    # insert the warnings found
-    num=0
-    for warning in results["warnings"]:
-        num=num+1
-        logging.info("Upserting warning num=%d",num)
-        upsert_error(conn, ivoid, url, date_today_s, "warning", num, warning["name"], warning["msg"], warning["section"])
-    
-    # insert the errors found
-    num=0
-    for error in results["errors"]:
-        num=num+1
-        logging.info("Upserting error num=%d",num)
-        upsert_error(conn, ivoid, url, date_today_s, "error", num, error["name"], error["msg"], error["section"])
-    
-    # insert the fatals found
-    num=0
-    for fatal in results["fatals"]:
-        num=num+1
-        logging.info("Upserting fatal num=%d",num)
-        upsert_error(conn, ivoid, url, date_today_s, "fatal", num, fatal["name"], fatal["msg"], fatal["section"])
-    
-    # insert the failures found
-    num=0
-    for fail in results["fails"]:
-        num=num+1
-        logging.info("Upserting failure num=%d",num)
-        upsert_error(conn, ivoid, url, date_today_s, "failure", num, fail["name"], fail["msg"], fail["section"])
-       
-              
+    # the services and their errors are written in one transaction
+    with db.transaction(conn):
+        
+        # date of the previous validation of the services whose errors are stored, before it is updated
+        error_services = services
+        if(errors_first_only):
+            error_services = services[:1]
+        prev_dates = {}
+        for (ivoid,url) in error_services:
+            cur = db.execute_db(conn,prev_date_query,(ivoid, url))
+            row = cur.fetchone()
+            prev_dates[(ivoid,url)] = row[0] if row!=None else None
+    
+        logging.info("Updating table services for services")
+
+        rows = []
+        for (ivoid,url) in services:
+            rows.append([new_result_vot
+                   ,new_result_spec
+                   ,new_nb_warn
+                   ,new_nb_err
+                   ,new_nb_fatal
+                   ,new_nb_fail 
+                   ,date_today_s
+                   ,date_today_s
+                   ,date_today_s
+                   ,new_result_vot
+                   ,new_result_spec
+                   ,new_nb_warn
+                   ,new_nb_err
+                   ,new_nb_fatal
+                   ,new_nb_fail 
+                   ,ivoid, url])
+        cur = db.executemany_db(conn,update_services_query,rows)
+        
+        for (ivoid,url) in error_services:
+            (nb_errors,nb_new) = store_errors(conn, ivoid, url, date_today_s, prev_dates[(ivoid,url)], results)
+            logging.info("Stored %d errors (%d new) for service ivoid=%s url=%s",nb_errors,nb_new,ivoid,url)
      
     return
 
 
-
+def iter_tap_reports(stream,totals):
+    '''
+    walk the JSON output of TAP validator taplint without building the whole document: {"sections":[{"code":..,"reports":[..]},..],"totals":{..}}
+    :param stream: jsonstream.JsonStream object
+    :param totals: dict where the totals of the document are put, if found
+    :return: generator of (section code, report) for each report found
+    '''
+    stream.expect("{")
+    while(not stream.skip("}")):
+        key = stream.value()
+        stream.expect(":")
+        
+        if(key=="sections"):
+            stream.expect("[")
+            while(not stream.skip("]")):
+                stream.expect("{")
+                section_code = None
+                waiting = [] # reports found before the code of their section
+                while(not stream.skip("}")):
+                    section_key = stream.value()
+                    stream.expect(":")
+                    if(section_key=="code"):
+                        section_code = stream.value()
+                        for report in waiting:
+                            yield (section_code,report)
+                        waiting = []
+                    elif(section_key=="reports"):
+                        stream.expect("[")
+                        while(not stream.skip("]")):
+                            report = stream.value() # only one report is decoded at a time
+                            if(section_code==None):
+                                waiting.append(report)
+                            else:
+                                yield (section_code,report)
+                            stream.skip(",")
+                    else: # ex: title
+                        stream.value()
+                    stream.skip(",")
+                for report in waiting: # section without code
+                    yield ("N/A",report)
+                stream.skip(",")
+        
+        elif(key=="totals"):
+            totals.update(stream.value())
+        
+        else:
+            stream.value()
+        
+        stream.skip(",")
 
 
 def parse_tap_validator(data):
     '''
-    parse JSON output from TAP validator taplint 
-    :param data: JSON data returned by TAP validator taplint
+    parse JSON output from TAP validator taplint while it is read, only the ERROR/WARNING/FAILURE reports are kept
+    :param data: JSON data returned by TAP validator taplint, as a string or a file-like object (ex: HTTP response)
     :return: structure containing information about the errors/warnings/fatals/fails
     '''
     # default values, they will be returned like that if the parsing failed with an exception
@@ -279,65 +487,61 @@ def parse_tap_validator(data):
     
     #logging.debug(data)
     
-    # Parse JSON 
+    # Parse JSON incrementally
+    stream = jsonstream.JsonStream(data)
+    totals = {}
+    nb_reports = 0
+    truncated = False
     try:
-        output = json.loads(data)
-        #logging.debug(output)
-        
-        # Parse nb of warnings/errors/failures
-        nb_warn = output['totals']['WARNING']
-        nb_err = output['totals']['ERROR']
-        nb_fail = output['totals']['FAILURE']
-        nb_fatal = 0 # taplint does not issue any fatal error, so 0
-        
-        
-        logging.info("nb_warn=%d nb_err=%d nb_fatal=%d nb_fail=%d",nb_warn,nb_err,nb_fatal,nb_fail)
+        for (section_code,report) in iter_tap_reports(stream,totals):
+            nb_reports += 1
+            
+            level = report["level"]
+            
+            if(level=="ERROR"):
+                reports = errors
+            elif(level=="WARNING"):
+                reports = warnings
+            elif(level=="FAILURE"):
+                reports = fails
+            else: # INFO, SUMMARY...
+                continue
+            
+            if("text" in report):
+                text = report["text"]
+            else:
+                text = "N/A"
+            
+            reports.append({"name":report["code"], "msg":text, "section":section_code})
         
+    except jsonstream.Truncated as e:
+        # In case of timeout the JSON is not complete: keep the reports found so far, if any
+        truncated = True
+        if(nb_reports>0):
+            logging.warning("JSON data truncated after %d bytes and %d reports (timeout?). Using partial results.",stream.nb_bytes,nb_reports)
+            nb_warn = len(warnings)
+            nb_err = len(errors)
+            nb_fail = len(fails)
+            nb_fatal = 0
+        else:
+            logging.error("JSON data truncated after %d bytes without any report (timeout?). Using default results (-1).",stream.nb_bytes)
     
-        # Parse individual errors
-        sections = output["sections"]
-        for section in sections:
-            section_code = section["code"]
-            reports = section["reports"]
-            for report in reports:
-                
-                level = report["level"]
-                code = report["code"]
-                
-                if("text" in report):
-                    text = report["text"]
-                else:
-                    text = "N/A"
-                    
-                    
-                    
-                if(level=="ERROR"):
-                    error={}
-                    error["name"] = code
-                    error["msg"] = text 
-                    error["section"] = section_code
-                    errors.append(error)
-                    
-                if(level=="WARNING"):
-                    warning={}
-                    warning["name"] = code
-                    warning["msg"] = text 
-                    warning["section"] = section_code
-                    warnings.append(warning)
-                    
-                if(level=="FAILURE"):
-                    fail={}
-                    fail["name"] = code
-                    fail["msg"] = text 
-                    fail["section"] = section_code
-                    fails.append(fail)
-                
-        
     except Exception as e:
-        # In case of timeout, we get here with "No JSON object could be decoded" or other JSON error, then res will contain the defaults value, indicating a timeout
-        logging.error("EXCEPTION %s during JSON parsing of data=%s",e,data)    
-        
+        # other JSON error, res will contain the defaults values
+        logging.error("EXCEPTION %s during JSON parsing after %d bytes and %d reports. Using default results (-1).",e,stream.nb_bytes,nb_reports)
+        warnings=[]
+        errors=[]
+        fails=[]
+    
+    else:
+        # Parse nb of warnings/errors/failures: from the totals of the document, else from the reports found
+        nb_warn = totals.get('WARNING',len(warnings))
+        nb_err = totals.get('ERROR',len(errors))
+        nb_fail = totals.get('FAILURE',len(fails))
+        nb_fatal = 0 # taplint does not issue any fatal error, so 0
+    
     
+    logging.info("nb_warn=%d nb_err=%d nb_fatal=%d nb_fail=%d",nb_warn,nb_err,nb_fatal,nb_fail)
     
     res = {
          "result_vot"       : result_vot
@@ -350,6 +554,7 @@ def parse_tap_validator(data):
         ,"errors"           : errors
         ,"fatals"           : fatals
         ,"fails"            : fails 
+        ,"truncated"        : truncated # the JSON was not complete, see validate_service
     }
     return res
 
@@ -391,13 +596,12 @@ def extract_dal_errors(nodes):
         
 def parse_dal_validator(spec,data):
     '''
-    parse output from VOParis DAL validator 
+    parse output from VOParis DAL validator while it is read
     :param spec: specification
-    :param data: XML data returned by VOParis DAL validator
+    :param data: XML data returned by VOParis DAL validator, as a string or a file-like object (ex: HTTP response)
     :return: structure containing information about the errors/warnings/fatals
     '''
     logging.info("Parsing XML data") # : %s",data)
-    logging.debug("XML data: %s",data)
 
     # default values, they will be returned like that if the parsing failed with an exception
     result_vot=""
@@ -411,57 +615,64 @@ def parse_dal_validator(spec,data):
     fatals=[]
     fails=[]
     
-    # Parse the XML result of DAL validator
+    # Parse the XML result of DAL validator in one pass while it is read: each child of the root element is processed
+    # once complete, then dropped, so the memory used does not depend on the size of the XML
+    ns = "{http://voparis-validator.obspm.fr/}"
     try:
-        root = ET.fromstring(data) # initialize XML parsing
-        
-        # Useful to debug the tree
-        #for node in root.iter():
-        #    print node.tag, node.attrib
-        
+        if(not hasattr(data,"read")):
+            data = cStringIO.StringIO(data)
         
-        
-        #print(root.tag)
-        node_result_vot = root.find("{http://voparis-validator.obspm.fr/}valid[@spec='VOTable']")
-        if(node_result_vot!=None): # in case of fatal ERROR_RETRIEVING, that node is not found
-            result_vot=node_result_vot.text
-            #print(result_vot) 
-        node_result_spec = root.find("{http://voparis-validator.obspm.fr/}valid[@spec='"+spec+"']")
-        if(node_result_spec!=None): # in case of fatal ERROR_RETRIEVING, that node is not found
-            result_spec=node_result_spec.text
-            #print(result_spec) 
-        
-        # Retrieve warnings and count them
-        nodes_warnings = root.findall("{http://voparis-validator.obspm.fr/}warning")
-        #print(node_warnings)
-        nb_warn=len(nodes_warnings)
-        # extract the warnings infos
-        warnings = extract_dal_errors(nodes_warnings)
+        found_vot = False
+        found_spec = False
+        root = None
+        depth = 0
+        for (event, node) in ET.iterparse(data, events=("start","end")):
+            if(event=="start"):
+                if(root==None):
+                    root = node
+                depth += 1
+                continue
+            
+            depth -= 1
+            if(depth!=1): # only the children of the root element are used
+                continue
+            
+            # NB: in case of fatal ERROR_RETRIEVING, the valid nodes are not found
+            if(node.tag==ns+"valid"):
+                if(node.get("spec")=="VOTable" and not found_vot):
+                    result_vot=node.text
+                    found_vot = True
+                elif(node.get("spec")==spec and not found_spec):
+                    result_spec=node.text
+                    found_spec = True
+            
+            # extract the warnings/errors/fatals infos
+            elif(node.tag==ns+"warning"):
+                warnings.extend(extract_dal_errors([node]))
+            elif(node.tag==ns+"error"):
+                errors.extend(extract_dal_errors([node]))
+            elif(node.tag==ns+"fatal"):
+                fatals.extend(extract_dal_errors([node]))
+            
+            root.clear() # drop the children processed so far
         
         logging.debug("Warnings found: %s", warnings)
-        
-        # Retrieve errors and count them
-        nodes_errors = root.findall("{http://voparis-validator.obspm.fr/}error")
-        #print(node_errors)
-        nb_err=len(nodes_errors)    
-        # Extract the errors infos
-        errors = extract_dal_errors(nodes_errors)
-
         logging.debug("Errors found: %s",errors)
-            
-        # Retrieve fatals and count them
-        nodes_fatals = root.findall("{http://voparis-validator.obspm.fr/}fatal")
-        #print(node_fatals)
-        nb_fatal=len(nodes_fatals)    
-        # extract the fatal names
-        fatals = extract_dal_errors(nodes_fatals)
-        
         logging.debug("Fatals found: %s",fatals)
         
+        # count them
+        nb_warn=len(warnings)
+        nb_err=len(errors)
+        nb_fatal=len(fatals)
         nb_fail = 0 # for DAL services always 0
     
     except Exception as e:
-        logging.error("EXCEPTION %s during XML parsing of data=%s",e,data)
+        logging.error("EXCEPTION %s during XML parsing. Using default results (-1).",e)
+        result_vot=""
+        result_spec=""
+        warnings=[]
+        errors=[]
+        fatals=[]
     
     logging.info("result_vot=%s result_spec=%s nb_warn=%d nb_err=%d nb_fatal=%d nb_fail=%d",result_vot,result_spec,nb_warn,nb_err,nb_fatal,nb_fail)
     
@@ -484,7 +695,7 @@ def parse_validator(spec,data):
     '''
     parse results from a validator by calling the right parse_*_validator function
     :param spec: specification
-    :param data: XML or JSON data returned by the validator
+    :param data: XML or JSON data returned by the validator, as a string or a file-like object (ex: HTTP response)
     :return: structure containing information about the errors/warnings/fatals
     '''
     
@@ -496,13 +707,160 @@ def parse_validator(spec,data):
     
 
 
-def validate_service(conn,service,timeout):
+def normalize_url(url):
+    '''
+    normalize an access URL to find the services having the same one: lower case scheme and host, no default port,
+    no trailing ? or &
+    :param url: access URL of a service
+    :return: normalized URL
+    '''
+    parts = urlparse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if((scheme=="http" and netloc.endswith(":80")) or (scheme=="https" and netloc.endswith(":443"))):
+        netloc = netloc[:netloc.rindex(":")]
+    return urlparse.urlunsplit((scheme, netloc, parts.path or "/", parts.query.rstrip("&"), ""))
+
+
+def new_timings(service):
+    '''
+    :param service: array containing attributes of the service per SQL query done in main (see validate_service)
+    :return: timings of the validation of the service, filled by validate_service, validate_services and store_result
+    '''
+    host = urlparse.urlparse(service[1]).hostname
+    return {
+                 "id"               : service[0]
+                ,"url"              : service[1]
+                ,"spec"             : service[2]
+                ,"host"             : host if host!=None else service[1]
+                ,"nb_services"      : len(service[5])
+                ,"outcome"          : None
+                ,"http_status"      : None
+                ,"size"             : 0
+                ,"connect_secs"     : 0.0
+                ,"ttfb_secs"        : 0.0
+                ,"read_secs"        : 0.0
+                ,"parse_secs"       : 0.0
+                ,"db_secs"          : 0.0
+                ,"total_secs"       : 0.0
+    }
+
+
+def store_timings(conn,run,timings):
+    '''
+    store the timings of a validation in table timings
+    :param conn: sqlite3 connection object
+    :param run: start of the run of val.py (YYYY-MM-DD HH:MM:SS)
+    :param timings: see new_timings
+    '''
+    db.execute_db(conn,insert_timings_query,(run,timings["id"],timings["url"],timings["spec"],timings["host"],timings["nb_services"]
+                                             ,timings["outcome"],timings["http_status"],timings["size"],timings["connect_secs"]
+                                             ,timings["ttfb_secs"],timings["read_secs"],timings["parse_secs"],timings["db_secs"]
+                                             ,timings["total_secs"]))
+
+
+def store_result(conn,result,run=None):
     '''
-    validate one service: calls validator and update the sqlite3 DB
+    apply to the sqlite3 DB a result returned by validate_service, or sent by validate_services when there is nothing to update
     :param conn: sqlite3 connection object
-    :param service: array containing attributes of the service per SQL query done 
-    :param timeout: timeout for calling the validator
+    :param result: result returned by validate_service (its results may have timings, see new_timings), or ("timings",timings)
+    :param run: start of the run of val.py, the timings are not stored if None
     '''
+    
+    if(result[0]=="update"):
+        (services,spec,results) = result[1:]
+        timings = results.get("timings")
+        t_start = time.time()
+        # for TAP, many services with different IVOIDs have the same URL (ex: VizieR), their errors are stored only once
+        update_service(conn,services,results,spec=="Table Access Protocol")
+        if(timings!=None):
+            timings["db_secs"] = time.time()-t_start
+    elif(result[0]=="timings"):
+        timings = result[1]
+    else:
+        logging.error("Unknown result type %s",result[0])
+        return
+    
+    if(run!=None and timings!=None):
+        store_timings(conn,run,timings)
+    
+    return
+
+
+# value of the services.nb_* cols when the validation is aborted, per exception
+abort_codes = {
+     httppool.ReadTimeout       : -1 # the validator did not answer before the deadline
+    ,httppool.ConnectTimeout    : -2 # could not connect to the validator before the deadline
+    ,httppool.Oversize          : -3 # the output of the validator is bigger than --max-size
+}
+
+
+def default_results(code):
+    '''
+    :param code: value of the nb_* results, see abort_codes (-1 also for any other failure)
+    :return: the results to use when the validation could not be done
+    '''
+    return {
+                 "result_vot"       : ""
+                ,"result_spec"      : ""
+                ,"nb_warn"          : code
+                ,"nb_err"           : code
+                ,"nb_fatal"         : code
+                ,"nb_fail"          : code
+                ,"warnings"         : []
+                ,"errors"           : []
+                ,"fatals"           : []
+                ,"fails"            : [] 
+    }
+
+
+def validator_url(spec,specv,params,url,timeout):
+    '''
+    :param spec: spec of the service
+    :param specv: spec version
+    :param params: validator params of the service
+    :param url: URL of the service
+    :param timeout: deadline of the validation, in secs (given to the TAP validator)
+    :return: URL to call the validator with
+    '''
+    # Construct validator url: validator base URL
+    vurl = validatorBaseURLs[spec]
+    # add validator params
+    #vurl += validatorParams[spec]
+    vurl += params
+    # add spec and spec version
+    vurl += "&"+urllib.urlencode({"spec":spec+" "+specv})
+    # add service URL
+    vurl += "&"+urllib.urlencode({"serviceURL":url})
+    
+    # Set TAP validator timeout
+    tap_timeout = timeout -1; # try to make sure TAP validator timeouts before our socket timeout 
+    if(tap_timeout<=0): tap_timeout=1
+    
+    if(spec=="Table Access Protocol"): # TAP validator also needs the timeout
+        vurl += "&"+urllib.urlencode({"timeout":tap_timeout})
+        vurl += "&"+urllib.urlencode({"maxtable":"1"}) # added 2018-04-05 to reduce time taken by TAP validation
+    
+    #vurl="https://www.test123456.com/" # debug - test timeout
+    
+    return vurl
+
+
+def validate_service(service,timeout,pool,max_size=0,store=None,timings=None):
+    '''
+    validate one service: calls validator and returns the update of the sqlite3 DB to be done by store_result
+    :param service: array containing attributes of the service per SQL query done in main, the last one being the list of
+    (ivoid,url) of all the services with the same URL, spec and parameters which get the same results
+    :param timeout: deadline for the whole validation, in secs
+    :param pool: httppool.Pool object used to call the validator, None to use only the outputs in store (--replay)
+    :param max_size: max nb of bytes of the output of the validator (0 = no limit)
+    :param store: archive.ResponseStore where the outputs of the validator are kept, or None
+    :param timings: dict where the time spent in each phase, the size of the output and the outcome are put (see new_timings), or None
+    :return: result to pass to store_result: ("update",services,spec,results) or None if nothing to update
+    '''
+    
+    if(timings==None):
+        timings = new_timings(service)
 
     # extract the service attributes, order is defined by SQL request done in main
     ivoid=service[0]
@@ -512,231 +870,294 @@ def validate_service(conn,service,timeout):
     specv=service[3]
     params=service[4]
     
-    logging.info("Processing service ivoid=%s url=%s spec=%s specv=%s",ivoid,url,spec,specv)
-    
-    # For TAP services, check if the url has already been validated today because
-    # there are many TAP services which have a different IVOID but the same URL
-    
-    # get today's date in format 2017-05-18 
-    date_today = datetime.datetime.today()
-    date_today_s=date_today.strftime('%Y-%m-%d')
-    
+    services=service[5]
     
-    # Check how many services with the same URL have been validated today
+    logging.info("Processing service ivoid=%s url=%s spec=%s specv=%s (%d services with same URL)",ivoid,url,spec,specv,len(services))
     
-    logging.info("Checking how many services with same URL validated today")
-    query = """
-            SELECT COUNT(*)
-            FROM services
-            WHERE url = ? AND date = ?
-            """
-    cur = db.execute_db(conn, query, (url, date_today_s))
-    nb_services = cur.fetchone()[0]
-    logging.debug("nb_services with same URL validated today=%d",nb_services)
-    
-    if((spec=="Table Access Protocol") and (nb_services>0)): # At least one TAP service with same URL validated today
-        
-        # Get the first one
-        logging.info("Getting first such service")
-        query = """
-            SELECT val_mode, result_vot, result_spec, nb_warn, nb_err, nb_fatal, nb_fail, days_same, id
-            FROM services
-            WHERE url = ? AND date = ?
-            """
-        cur = db.execute_db(conn, query, (url, date_today_s))
-        service = cur.fetchone()
-        prev_val_mode = service[0]
-        prev_result_vot = service[1]
-        prev_result_spec = service[2]
-        prev_nb_warn = service[3]
-        prev_nb_err = service[4]
-        prev_nb_fatal = service[5]
-        prev_nb_fail = service[6]
-        prev_days_same = service[7]
-        prev_ivoid = service[8]
-        
-        # Copy the previous results to the current service
-        logging.info("Updating current service with service found")
-        query = """
-            UPDATE services
-            SET date=?, val_mode=?, result_vot=?, result_spec=?, nb_warn=?, nb_err=?, nb_fatal=?, nb_fail=?, days_same=?
-            WHERE id=? AND url=?
-            """
-        cur = db.execute_db(conn, query, (date_today_s, prev_val_mode, prev_result_vot, prev_result_spec, prev_nb_warn, prev_nb_err, prev_nb_fatal, prev_nb_fail, prev_days_same, ivoid, url))
-        conn.commit()  # because of UPDATE
-
-        if(False): # Copy the errors too - disabled 2018-04-09 to reduce time - because of all TAP VizieR services / webapp updated to take this into account
-            logging.info("Copying errors")
-            query="""
-                SELECT type,num,name,msg,section
-                FROM errors
-                WHERE id=? AND url=? AND date=?
-                """
-            cur = db.execute_db(conn, query, (prev_ivoid,url,date_today_s))
-            errors = cur.fetchall()
-            for error in errors:
-                type = error[0]
-                num = error[1]
-                name = error[2]
-                msg = error[3]
-                section = error[4]
-                
-                upsert_error(conn, ivoid, url, date_today_s, type, num, name, msg, section)
-                
-        return
+
+    vurl = validator_url(spec,specv,params,url,timeout)
     
-    else: # Run validator
+    # the output of the validator may have been stored less than --cache-ttl ago, or at any time for --replay (no pool)
+    if(store!=None):
+        if(pool==None):
+            stored = store.get(vurl,0)
+        else:
+            stored = store.get(vurl)
+        if(stored!=None):
+            (f,mtime) = stored
+            logging.info("Using output of validator URL: %s stored at %s",vurl,datetime.datetime.fromtimestamp(mtime).isoformat())
+            t_parse = time.time()
+            try:
+                results = parse_validator(spec,f)
+            finally:
+                f.close()
+            timings["parse_secs"] = time.time()-t_parse # including reading the stored file
+            timings["outcome"] = "stored"
+            if(pool==None): # replay: the services were validated that day
+                results["date"] = datetime.date.fromtimestamp(mtime).strftime('%Y-%m-%d')
+            return ("update",services,spec,results)
+    
+    if(pool==None):
+        logging.warning("No stored output for validator URL: %s. Service not updated.",vurl)
+        timings["outcome"] = "not stored"
+        return None
+    
+    logging.info("Calling validator URL: %s (deadline is %d secs)",vurl,timeout)
+    
+    # the deadline covers the whole validation: connection, headers, body and parsing (which is done while reading).
+    # Each socket operation is given the time left before it, so a validator sending its output slowly can not hold the worker
+    deadline = httppool.Deadline(timeout)
     
-        # Construct validator url: validator base URL
-        vurl = validatorBaseURLs[spec]
-        # add validator params
-        #vurl += validatorParams[spec]
-        vurl += params
-        # add spec and spec version
-        vurl += "&"+urllib.urlencode({"spec":spec+" "+specv})
-        # add service URL
-        vurl += "&"+urllib.urlencode({"serviceURL":url})
-        
-        # Set TAP validator timeout
-        tap_timeout = timeout -1; # try to make sure TAP validator timeouts before our socket timeout 
-        if(tap_timeout<=0): tap_timeout=1
-        
-        if(spec=="Table Access Protocol"): # TAP validator also needs the timeout
-            vurl += "&"+urllib.urlencode({"timeout":tap_timeout})
-            vurl += "&"+urllib.urlencode({"maxtable":"1"}) # added 2018-04-05 to reduce time taken by TAP validation
-        
-        #vurl="https://www.test123456.com/" # debug - test timeout
-        
-        logging.info("Calling validator URL: %s (timeout is %d secs)",vurl,timeout)
-       
-        # set the timeout for call to urllib2.urlopen - not necessary urllib2.urlopen has a timeout parameter
-        # socket.setdefaulttimeout(float(timeout))
-        
-            
-        request = urllib2.Request(vurl)
+    try:
         
-        try:
-            
-            # NB: The optional timeout parameter specifies a timeout in seconds for blocking operations like the connection attempt 
-            # It seems that the timeout is useless here for timeouting the TAP validator : https://www.daniweb.com/programming/software-development/threads/182555/how-to-set-timeout-for-reading-from-urls-in-urllib
-            # => the timeout there it is only for opening url. It wont give exception while reading.
-            
-            
-            response = urllib2.urlopen(request,timeout=timeout)   
-            http_status = response.getcode()
+        # the connection to the validator comes from the pool and goes back to it once the response is read,
+        # it is closed if the deadline passes or the response is bigger than max_size
+        with pool.urlopen(vurl,timeout,deadline,max_size,timings=timings) as response:
+            http_status = response.status
+            timings["http_status"] = http_status
             logging.debug("HTTP status: %d",http_status) 
-        except Exception as e: 
-            logging.error("EXCEPTION %s while calling URL=%s. Using default results (-1).",e,vurl)
-            
-            # These are the results to use in case of timeout:
-            results = {
-                         "result_vot"       : ""
-                        ,"result_spec"      : ""
-                        ,"nb_warn"          : -1
-                        ,"nb_err"           : -1
-                        ,"nb_fatal"         : -1
-                        ,"nb_fail"          : -1
-                        ,"warnings"         : []
-                        ,"errors"           : []
-                        ,"fatals"           : []
-                        ,"fails"            : [] 
-            }
-            # Update the service with the results
-            update_service(conn,ivoid,url,results)  
-                
-        except socket.timeout as e:
-            logging.error("EXCEPTION: socket timeout: %s while calling URL=%s. Using defaults results (-2).",e,vurl)
             
-            # These are the results to use in case of *socket* timeout:
-            results = {
-                         "result_vot"       : ""
-                        ,"result_spec"      : ""
-                        ,"nb_warn"          : -2
-                        ,"nb_err"           : -2
-                        ,"nb_fatal"         : -2
-                        ,"nb_fail"          : -2
-                        ,"warnings"         : []
-                        ,"errors"           : []
-                        ,"fatals"           : []
-                        ,"fails"            : [] 
-            }
-            # Update the service with the results
-            update_service(conn,ivoid,url,results)          
-          
-        else: # if no exception 
             if(http_status==200):
-                try:
-                    # set a timer here to have a timeout during reading of data from URL, but tapvalidator.php does not stop correctly
-                    #t = Timer(timeout, response.close)
-                    #t.start()
-                    logging.debug("Reading data.") 
-                    data = response.read() # get response in either XML or JSON format
-                    #t.cancel()
-                    logging.debug("Reading data done.") # we end up here in case tapvalidator.php times out. The unfinished JSON will make throw an exception in parse_tap_validator
-                except Exception as e: # try to catch timeout exception... not sure it works
-                    logging.error("EXCEPTION %s (timeout?) while reading data from URL=%s. Using default results (-1).",e,vurl)
+                # the response (XML or JSON) is parsed while it is read. In case tapvalidator.php times out, the JSON is not
+                # complete and parse_tap_validator keeps the reports read so far. Exceptions while reading give the default results (-1)
+                # the output is written to the store (--cache-dir) while it is read, it is kept only if read until its end
+                logging.debug("Reading and parsing data.") 
+                t_parse = time.time()
+                if(store!=None):
+                    writer = store.writer(vurl,response)
+                    try:
+                        results = parse_validator(spec,writer)
+                    finally:
+                        writer.close()
+                else:
+                    results = parse_validator(spec,response)
+                logging.debug("Reading and parsing data done (%d bytes).",response.nb_bytes)
+                timings["parse_secs"] = max(time.time()-t_parse-timings["read_secs"],0.0) # the output is parsed while it is read
+                timings["size"] = response.nb_bytes
+                timings["outcome"] = "ok"
                 
-                    # These are the results to use in case of timeout:
-                    results = {
-                         "result_vot"       : ""
-                        ,"result_spec"      : ""
-                        ,"nb_warn"          : -1
-                        ,"nb_err"           : -1
-                        ,"nb_fatal"         : -1
-                        ,"nb_fail"          : -1
-                        ,"warnings"         : []
-                        ,"errors"           : []
-                        ,"fatals"           : []
-                        ,"fails"            : [] 
-                    }
+                # the output is not logged: the writer reads it until its end and keeps it in the store
+                if(results["nb_warn"]<0 and response.aborted==None):
+                    timings["outcome"] = "parse error"
+                    if(store!=None):
+                        logging.error("Could not parse the output of validator URL=%s, kept in %s",vurl,store.file_path(vurl))
                 
+                # the body was read entirely but the JSON is not complete (ex: tapvalidator.php timed out): not a clean validation
+                if(results.get("truncated") and response.aborted==None):
+                    timings["outcome"] = "partial"
                 
-                else:
-                    #logging.info(data)            
-                    results = parse_validator(spec,data)
+                # the parsers catch the exceptions while reading: get the outcome from the response
+                if(response.aborted!=None):
+                    e = response.aborted
+                    code = abort_codes.get(type(e),-1)
+                    if(results["nb_warn"]<0):
+                        logging.error("EXCEPTION %s while reading URL=%s. Using default results (%d).",e,vurl,code)
+                        results = default_results(code)
+                        timings["outcome"] = type(e).__name__
+                    else:
+                        logging.warning("EXCEPTION %s while reading URL=%s. Using partial results.",e,vurl)
+                        timings["outcome"] = "partial"
+        
+    except httppool.Aborted as e:
+        code = abort_codes.get(type(e),-1)
+        logging.error("EXCEPTION %s: %s while calling URL=%s. Using default results (%d).",type(e).__name__,e,vurl,code)
+        timings["outcome"] = type(e).__name__
+        return ("update",services,spec,default_results(code))
+    
+    except Exception as e: 
+        logging.error("EXCEPTION %s while calling URL=%s. Using default results (-1).",e,vurl)
+        timings["outcome"] = type(e).__name__
+        if(isinstance(e,httppool.HTTPError)):
+            timings["http_status"] = e.status
+        return ("update",services,spec,default_results(-1))
+      
+    else: # if no exception 
+        if(http_status==200):
+            # Update the service with the results
+            return ("update",services,spec,results)
                 
-                # Update the service with the results
-                update_service(conn,ivoid,url,results)  
-                    
-            else: # http_status!=200
-                logging.error("HTTP status is not 200 but %d. Giving up.",http_status)
+        else: # http_status!=200
+            logging.error("HTTP status is not 200 but %d. Giving up.",http_status)
+            timings["outcome"] = "http %d" % http_status
 
-        return
+    return None
 
 
-def validate_services(services,timeout,db_file):
+def group_services(cur):
     '''
-    worker function to validate several services
-    :param services: array of services returned by SQL query
-    :param timeout: timeout for calling the validator
-    :param db_file: name of the sqlite3 DB file 
+    group the services read from a cursor of services_query: the services with the same URL (once normalized), spec, spec version
+    and params get the same results, so the validator is called only once for them. The rows of a group are consecutive
+    :param cur: cursor of services_query
+    :return: generator of the groups, as (id,url,spec,specv,params,[(id,url) of the services]), id and url being those of the first
+    service of the group, used to call the validator
+    '''
+    group = None
+    for row in cur:
+        if(group==None or row[5]!=key[0] or row[2:5]!=key[1:]):
+            if(group!=None):
+                yield tuple(group)
+            key = (row[5],)+row[2:5]
+            group = list(row[0:5])+[[]]
+        group[5].append((row[0],row[1]))
+    if(group!=None):
+        yield tuple(group)
+
+
+class Scheduler(object):
+    '''
+    decide in which order the services are validated: the services of the different hosts are interleaved and at most
+    max_per_validator validations run at the same time for each validator base URL (see validatorBaseURLs) and at most
+    max_per_host for each host of the services (0 = no limit)
     '''
     
-    # open our own connection to the DB (since we are running in parallel)
+    def __init__(self, max_per_validator=0, max_per_host=0):
+        self.max_per_validator = max_per_validator
+        self.max_per_host = max_per_host
+        self.validators = collections.deque() # validator base URLs, in round-robin order
+        self.pending = {} # (validator,host) -> deque of services waiting to be validated
+        self.ready = {} # validator -> deque of hosts having services waiting for this validator
+        self.blocked = {} # host -> list of validators having services waiting for this host to be under its limit
+        self.queued = set() # (validator,host) which are in ready or blocked
+        self.running_validator = {} # validator -> nb of validations running
+        self.running_host = {} # host -> nb of validations running
+        self.nb_pending = 0
+    
+    def keys(self, service):
+        '''
+        :param service: array containing attributes of the service per SQL query done in main
+        :return: (validator base URL, host of the service)
+        '''
+        validator = validatorBaseURLs.get(service[2],"")
+        host = urlparse.urlparse(service[1]).hostname
+        if(host==None): # not a valid URL, use it as host
+            host = service[1]
+        return (validator,host)
+    
+    def add(self, service):
+        '''
+        add a service to validate
+        '''
+        (validator,host) = self.keys(service)
+        if(validator not in self.ready):
+            self.validators.append(validator)
+            self.ready[validator] = collections.deque()
+            self.running_validator[validator] = 0
+        
+        self.pending.setdefault((validator,host),collections.deque()).append(service)
+        self.nb_pending += 1
+        if((validator,host) not in self.queued):
+            self.ready[validator].append(host)
+            self.queued.add((validator,host))
+    
+    def next(self):
+        '''
+        :return: the next service that can be validated now without exceeding the limits, None if there is none
+        '''
+        for i in range(len(self.validators)):
+            validator = self.validators[0]
+            self.validators.rotate(-1) # next call starts with the next validator
+            if(self.max_per_validator>0 and self.running_validator[validator]>=self.max_per_validator):
+                continue
+            
+            ready = self.ready[validator]
+            while(ready):
+                host = ready.popleft()
+                if(self.max_per_host>0 and self.running_host.get(host,0)>=self.max_per_host):
+                    # put the host aside until one of its validations is done
+                    self.blocked.setdefault(host,[]).append(validator)
+                    continue
+                
+                pending = self.pending[(validator,host)]
+                service = pending.popleft()
+                self.nb_pending -= 1
+                if(pending): # the host goes to the end of the line
+                    ready.append(host)
+                else:
+                    del self.pending[(validator,host)]
+                    self.queued.discard((validator,host))
+                
+                self.running_validator[validator] += 1
+                self.running_host[host] = self.running_host.get(host,0)+1
+                return service
+        
+        return None
+    
+    def done(self, service):
+        '''
+        tell the scheduler the validation of a service returned by next() is done
+        '''
+        (validator,host) = self.keys(service)
+        self.running_validator[validator] -= 1
+        self.running_host[host] -= 1
+        if(self.running_host[host]==0):
+            del self.running_host[host]
+        
+        # the services put aside for this host can be validated again
+        for validator_blocked in self.blocked.pop(host,[]):
+            self.ready[validator_blocked].append(host)
+
+
+def validate_services(worker,jobs,done,timeout,results,pool,max_size=0,store=None):
+    '''
+    worker function to validate services taken one by one from the jobs queue
+    :param worker: nb of the worker, sent back with each service done
+    :param jobs: queue of services of this worker (as prepared by main for validate_service), None means no more service
+    :param done: queue where the worker tells main that its service is validated, as (worker, duration of the validation in secs)
+    :param timeout: deadline for each validation, in secs
+    :param results: queue where the results are sent to the writer process, ("end",worker) is sent when the worker is done
+    :param pool: httppool.Pool shared with other workers (engine thread) or tuple (size,idle_timeout) to create our own (engine process),
+    None to use only the outputs in store (--replay)
+    :param max_size: max nb of bytes of the output of the validator (0 = no limit)
+    :param store: archive.ResponseStore where the outputs of the validator are kept, or None
+    '''
     
-    logging.info("Opening DB file %s",db_file)  
-    conn = db.open_db(db_file)
+    if(isinstance(pool,tuple)): # one pool per process
+        pool = httppool.Pool(pool[0],pool[1])
+        own_pool = True
+    else:
+        own_pool = False
     
+    # NB: the workers do not access the DB, all writes are done by the writer
     
     no_service=0
-    nb_services=len(services)
     
-    logging.info("Worker starting to process %d services",nb_services)
+    logging.info("Worker starting to process services")
     
-    for service in services:
-        no_service=no_service+1
-        logging.info("Processing service %d/%d",no_service,nb_services)
-        validate_service(conn,service,timeout)
-        
-        # retrieve individual columns - same order as query in main
-        
+    try:
+        while(True):
+            service = jobs.get()
+            if(service==None): # no more service
+                break
+            no_service=no_service+1
+            logging.info("Processing service %d of this worker",no_service)
+            t_start = time.time()
+            timings = new_timings(service)
+            try:
+                try:
+                    result = validate_service(service,timeout,pool,max_size,store,timings)
+                except Exception as e:
+                    logging.error("EXCEPTION %s while validating service ivoid=%s url=%s",e,service[0],service[1])
+                    timings["outcome"] = type(e).__name__
+                    result = None
+                # the timings go to the writer with the results, or alone if there is nothing to update
+                timings["total_secs"] = time.time()-t_start
+                if(result!=None):
+                    result[3]["timings"] = timings
+                    results.put(result)
+                else:
+                    results.put(("timings",timings))
+            finally:
+                done.put((worker,time.time()-t_start)) # tell the scheduler in main, with the duration of the validation
+    finally:
+        # tell the writer this worker is done
+        results.put(("end",worker))
     
     #time.sleep(2)
 
-    # close DB connection before end of ps 
-    logging.info('Closing DB connection')
-    conn.close()
     logging.info("Worker finished with %d services processed",no_service)
+    if(own_pool):
+        pool.log_stats()
+        pool.close()
     
     
     
@@ -744,13 +1165,137 @@ def validate_services(services,timeout,db_file):
     return
 
 
+def write_results(results,db_file,db_profile,nb_workers,commit_rows,commit_secs,stats,run=None):
+    '''
+    writer function: the only one to write to the sqlite3 DB, applies the results sent by the workers in batches of transactions
+    :param results: queue where the workers send their results
+    :param db_file: name of the sqlite3 DB file 
+    :param db_profile: performance profile of the DB connection, see db.profiles
+    :param nb_workers: nb of workers sending results, the writer stops when all of them have sent ("end",worker) (sent by main
+    for a dead worker, so it may be received twice)
+    :param commit_rows: commit the results every commit_rows rows written
+    :param commit_secs: or every commit_secs seconds
+    :param stats: queue where the writer sends {"nb_results":..,"nb_failed":..,"db_secs":..,"query_stats":..} when it is done, db_secs being the time spent
+    writing to the DB (not waiting for the results) and query_stats the db.query_stats of the writer
+    :param run: start of the run of val.py, to store the timings of the validations with (None = not stored)
+    '''
+    
+    logging.info("Opening DB file %s",db_file)  
+    conn = db.open_db(db_file,db_profile)
+    
+    nb_results=0
+    nb_failed=0 # results which could not be stored
+    ended=set() # workers done
+    wait_secs=0
+    ppid = os.getppid() # main process (engine process)
+    
+    logging.info("Writer starting, waiting for the results of %d workers",nb_workers)
+    
+    t_start = time.time()
+    policy = db.CommitPolicy(commit_rows,commit_secs)
+    with db.batch(conn,policy):
+        while(len(ended)<nb_workers):
+            t_wait = time.time()
+            try:
+                result = results.get(True,check_secs)
+            except Queue.Empty:
+                result = None
+            wait_secs += time.time()-t_wait
+            if(result==None):
+                if(os.getppid()!=ppid): # nobody to send the end of the workers anymore
+                    logging.error("Main process is dead, the writer stops with %d workers not done",nb_workers-len(ended))
+                    break
+                continue
+            if(result[0]=="end"): # a worker is done
+                ended.add(result[1])
+                continue
+            nb_results=nb_results+1
+            logging.info("Storing result %d for %d services",nb_results,len(result[1]))
+            # a result which can not be stored is given up: its transaction is rolled back, not the batch
+            try:
+                store_result(conn,result,run)
+            except Exception as e:
+                nb_failed=nb_failed+1
+                logging.error("EXCEPTION %s while storing result %d (%s). Result not stored.",e,nb_results,result[0])
+    db_secs = time.time()-t_start-wait_secs
+    
+    logging.info('Closing DB connection')
+    conn.close()
+    logging.info("Writer finished with %d results stored (%d not stored) in %.3f secs",nb_results-nb_failed,nb_failed,db_secs)
+    stats.put({"nb_results":nb_results-nb_failed,"nb_failed":nb_failed,"db_secs":db_secs,"query_stats":db.query_stats})
+    
+    return
+
+
+def percentile(values,p):
+    '''
+    :param values: list of numbers
+    :param p: percentile (0 to 100)
+    :return: the value of the list at percentile p (nearest rank), 0 if the list is empty
+    '''
+    if(not values):
+        return 0
+    values = sorted(values)
+    i = int(round(p/100.0*len(values)+0.5))-1
+    return values[min(max(i,0),len(values)-1)]
+
+
+def adaptive_where(date_s,max_age):
+    '''
+    SQL condition selecting the services due for validation with the adaptive schedule:
+    the services never validated or whose last validation failed (nb_* < 0) are validated every day,
+    the others again after days_same/2 days (at least 1 day, at most max_age days), so the interval between two validations
+    grows exponentially while the results stay the same
+    :param date_s: date of the validation in format 2017-05-18
+    :param max_age: max nb of days between two validations of a service
+    :return: SQL condition on table services
+    '''
+    return """(date IS NULL OR nb_warn<0 OR nb_err<0 OR nb_fatal<0 OR nb_fail<0
+               OR julianday('%s')-julianday(date) >= MIN(%d, MAX(1, COALESCE(days_same,0)/2)))""" % (date_s,max_age)
+
+
+def check_plans(conn,max_age):
+    '''
+    check with EXPLAIN QUERY PLAN that the hot queries of val.py and query-rr.py use indexes instead of reading whole tables
+    :param conn: sqlite3 connection object
+    :param max_age: max_age for the query of the adaptive schedule
+    :return: nb of queries which read a whole table
+    '''
+    date_s = datetime.date.today().strftime('%Y-%m-%d')
+    daily_where = "date_update >='"+date_s+"'"
+    adaptive = daily_where + " and " + adaptive_where(date_s,max_age)
+    conn.create_function("normalize_url",1,normalize_url)
+    hot_queries = [
+         ("count of the services to validate", count_services_query % daily_where, [])
+        ,("count of the services to validate (adaptive)", count_services_query % adaptive, [])
+        ,("services to validate", services_query % daily_where, [])
+        ,("services to validate (adaptive)", services_query % adaptive, [])
+        ,("previous validation date (update_service)", prev_date_query, ["i","u"])
+        ,("services update (update_service)", update_services_query, ["v","s",0,0,0,0,date_s,date_s,date_s,"v","s",0,0,0,0,"i","u"])
+        ,("errors of the previous validation (store_errors)", prev_errors_query, ["i","u",date_s])
+        ,("extension of the intervals (store_errors)", extend_intervals_query, [date_s,"i","u",date_s])
+        ,("end of an interval (store_errors)", close_interval_query, [date_s,"i","u","error",1,"n",1,date_s])
+        ,("removal of an interval (store_errors)", delete_interval_query, ["i","u","error",1,"n",1,date_s])
+        ,("errors of a date (get_errors)", get_errors_query, ["i","u",date_s,date_s])
+        ,("errors of a date (errors view)", "SELECT * FROM errors WHERE id = ? and url = ? and date = ?", ["i","u",date_s])
+        ,("errors of all the services of a date (errors view)", "SELECT * FROM errors WHERE date = ?", [date_s])
+        ,("removal of the old timings (main)", delete_timings_query, [date_s])
+    ]
+    
+    nb_scans = 0
+    for (name, sql, values) in hot_queries:
+        (plan, scans) = db.full_scans(conn, sql, values)
+        if(scans):
+            nb_scans += 1
+        print("%-4s %s: %s" % ("SCAN" if scans else "OK", name, " / ".join(plan)))
+    return nb_scans
 
 
 def usage():
     '''
     display this program's usage
     '''
-    print("Usage: %s -h --db <db_file> --ps <nb_processes> --timeout <timeout> --log <log_file>" % sys.argv[0])
+    print("Usage: %s -h --db <db_file> --schedule <daily|adaptive> --max-age <days> --force-all --engine <process|thread> --ps <nb_processes> --concurrency <nb_threads> --max-per-validator <n> --max-per-host <n> --pool-size <n> --pool-idle <secs> --timeout <timeout> --max-size <MB> --cache-dir <dir> --cache-ttl <hours> --cache-size <MB> --replay <cache_dir> --validator-url <base_url> --stats <json_file> --check-plans --db-profile <default|wal|bulk> --timings-keep <days> --log <log_file> --log-level <level> --log-levels <module=level,..> --log-max <nb_chars> --commit-rows <nb_rows> --commit-secs <secs> --max-pending <n>" % sys.argv[0])
     return
 
     
@@ -762,17 +1307,42 @@ def main(argv):
     
     
     
-    program_version="1.9"
+    program_version="4.1"
     #global logger
     
     # Read program arguments
     db_file=None # no default
-    nb_ps = 1 # nb of processes to use
-    timeout = 20  # timeout for validation of individual service, in secs
+    schedule = "daily" # validate all the services every day ("daily") or only those due per adaptive_where ("adaptive")
+    max_age = 30 # adaptive schedule: max nb of days between two validations of a service
+    force_all = False # True => validate all the services even with the adaptive schedule
+    engine = "process" # run the workers as processes ("process") or as threads of this process ("thread")
+    nb_ps = 1 # nb of processes to use (engine process)
+    concurrency = 100 # nb of threads to use (engine thread)
+    max_per_validator = 20 # max nb of validations running at the same time for one validator base URL (0 = no limit)
+    max_per_host = 4 # max nb of validations running at the same time for the services of one host (0 = no limit)
+    pool_size = 20 # max nb of idle connections kept for each validator host by each worker process (engine process) or by the process (engine thread)
+    pool_idle = 30 # idle connections to the validators are reused during pool_idle seconds
+    timeout = 20  # deadline for validation of individual service (connection, reading and parsing), in secs
+    max_size = 50 # max size of the output of the validator, in MB (0 = no limit)
+    cache_dir = None # directory where the outputs of the validators are stored (None = not stored)
+    cache_ttl = 0 # the stored outputs are used instead of calling the validators during cache_ttl hours (0 = never)
+    cache_size = 0 # max size of the stored outputs, in MB, the oldest are removed (0 = no limit)
+    replay_dir = None # directory of the stored outputs to use instead of calling the validators (None = call them)
+    validator_url_base = None # scheme://host:port/ of the validators to use instead of the VO-Paris ones (ex: stubval.py)
+    stats_file = None # file where the statistics of the run are written as JSON (None = only logged)
+    check = False # True => only check the plans of the hot queries (see check_plans), the exit status is 1 if one reads a whole table
+    db_profile = "wal" # performance profile of the DB connections, see db.profiles
+    timings_keep = 30 # the timings of the runs older than timings_keep days are removed from table timings (0 = never)
     log_file=None # no default
+    log_level = logging.INFO # level of the log, see also log_levels
+    log_levels = {} # level of the log for some modules (name of their .py file), ex: {"db":logging.DEBUG}
+    log_max = 2000 # the messages of the log are truncated after log_max characters (0 = no limit)
+    commit_rows = 1000 # the writer commits every commit_rows rows written
+    commit_secs = 10 # or every commit_secs seconds
+    max_pending = 10000 # max nb of groups of services read from the DB and waiting to be validated (0 = no limit), see main
     
     try:
-        opts, args = getopt.getopt(argv,"h",["db=","ps=","timeout=","log="])
+        opts, args = getopt.getopt(argv,"h",["db=","schedule=","max-age=","force-all","engine=","ps=","concurrency=","max-per-validator=","max-per-host=","pool-size=","pool-idle=","timeout=","max-size=","cache-dir=","cache-ttl=","cache-size=","replay=","validator-url=","stats=","check-plans","db-profile=","timings-keep=","log=","log-level=","log-levels=","log-max=","commit-rows=","commit-secs=","max-pending="])
     except getopt.GetoptError as err:
         print str(err)
         usage()
@@ -784,15 +1354,96 @@ def main(argv):
             sys.exit(0)
         elif o in ("--db"):
             db_file = a
+        elif o in ("--schedule"):
+            schedule = a
+            if(schedule not in ("daily","adaptive")):
+                print('ERROR: schedule must be daily or adaptive')
+                usage()
+                sys.exit(2)
+        elif o in ("--max-age"):
+            max_age = int(a)
+            if(max_age<1):
+                print('ERROR: max-age must be greater or equal to 1')
+                sys.exit(1)
+        elif o in ("--force-all"):
+            force_all = True
+        elif o in ("--engine"):
+            engine = a
+            if(engine not in ("process","thread")):
+                print('ERROR: engine must be process or thread')
+                usage()
+                sys.exit(2)
         elif o in ("--ps"):
             nb_ps = int(a)
+        elif o in ("--concurrency"):
+            concurrency = int(a)
+            if(concurrency<1):
+                print('ERROR: concurrency must be greater or equal to 1')
+                sys.exit(1)
+        elif o in ("--max-per-validator"):
+            max_per_validator = int(a)
+        elif o in ("--max-per-host"):
+            max_per_host = int(a)
+        elif o in ("--pool-size"):
+            pool_size = int(a)
+        elif o in ("--pool-idle"):
+            pool_idle = float(a)
         elif o in ("--timeout"):
             timeout = int(a)
             if(timeout<1):
                 logging.error("timeout must be greater or equal to 1")
                 sys.exit(1)
+        elif o in ("--max-size"):
+            max_size = float(a)
+        elif o in ("--cache-dir"):
+            cache_dir = a
+        elif o in ("--cache-ttl"):
+            cache_ttl = float(a)
+        elif o in ("--cache-size"):
+            cache_size = float(a)
+        elif o in ("--replay"):
+            replay_dir = a
+            if(not os.path.isdir(replay_dir)):
+                print('ERROR: replay directory %s not found' % replay_dir)
+                sys.exit(1)
+        elif o in ("--validator-url"):
+            validator_url_base = a
+        elif o in ("--stats"):
+            stats_file = a
+        elif o in ("--check-plans"):
+            check = True
+        elif o in ("--db-profile"):
+            if(a not in db.profiles):
+                print("ERROR: db profile must be one of %s" % ", ".join(sorted(db.profiles)))
+                usage()
+                sys.exit(2)
+            db_profile = a
+        elif o in ("--timings-keep"):
+            timings_keep = int(a)
         elif o in ("--log"):
             log_file = a
+        elif o in ("--log-level"):
+            try:
+                log_level = logqueue.parse_level(a)
+            except ValueError as err:
+                print str(err)
+                usage()
+                sys.exit(2)
+        elif o in ("--log-levels"):
+            try:
+                log_levels = logqueue.parse_levels(a)
+            except ValueError as err:
+                print("ERROR: log levels must be given as module=LEVEL,module=LEVEL (%s)" % err)
+                usage()
+                sys.exit(2)
+        elif o in ("--log-max"):
+            log_max = int(a)
+        elif o in ("--commit-rows"):
+            commit_rows = int(a)
+        elif o in ("--commit-secs"):
+            commit_secs = float(a)
+        elif o in ("--max-pending"):
+            max_pending = int(a)
         else:
             assert False, "unhandled option"
 
@@ -823,8 +1474,9 @@ def main(argv):
     
     
     
-    logging.basicConfig(format='%(asctime)s %(filename)s %(levelname)s %(lineno)d %(processName)s %(funcName)s: %(message)s'
-                        , level=logging.DEBUG, filename=log_file)
+    # the workers and the writer (engine process) log through the queue of the listener process started here
+    logqueue.setup(log_file,'%(asctime)s %(filename)s %(levelname)s %(lineno)d %(processName)s %(threadName)s %(funcName)s: %(message)s'
+                   ,log_level,log_levels,log_max)
 
     # Add colors - from https://stackoverflow.com/questions/384076/how-can-i-color-python-logging-output
     logging.addLevelName( logging.WARNING, "\033[1;31m%s\033[1;0m" % logging.getLevelName(logging.WARNING))
@@ -841,9 +1493,22 @@ def main(argv):
     
     logging.info("Running on %s",hostname)
     
+    # validators to use instead of the VO-Paris ones: same paths and params on another server
+    if(validator_url_base!=None):
+        base = urlparse.urlsplit(validator_url_base)
+        for spec in validatorBaseURLs:
+            parts = urlparse.urlsplit(validatorBaseURLs[spec])
+            validatorBaseURLs[spec] = urlparse.urlunsplit((base.scheme,base.netloc,base.path.rstrip("/")+parts.path,parts.query,""))
+            logging.info("Using validator %s for %s",validatorBaseURLs[spec],spec)
+    
 
     
-    conn = db.open_db(db_file)
+    conn = db.open_db(db_file,db_profile)
+    
+    if(check):
+        nb_scans = check_plans(conn,max_age)
+        conn.close()
+        sys.exit(1 if nb_scans>0 else 0)
 
     
     
@@ -857,6 +1522,15 @@ def main(argv):
     
     where = "date_update >='"+min_update_date_s+"'"
     
+    # adaptive schedule: only the services due today
+    if(schedule=="adaptive" and not force_all and replay_dir==None):
+        logging.info("Adaptive schedule with max_age=%d days",max_age)
+        where = where + " and " + adaptive_where(datetime.date.today().strftime('%Y-%m-%d'),max_age)
+    
+    # replay: all the services still in the registry, those without stored output are not scheduled (see below)
+    if(replay_dir!=None):
+        logging.info("Replaying the outputs stored in %s",replay_dir)
+    
     #where = where + " and id like '%vopdc%'"  # debug: 3 services 
     #where = where + " and url like '%.au%'" # debug: 7 services
     #where = where + " and id like '%irsa%'" # debug: 366 services
@@ -867,7 +1541,7 @@ def main(argv):
     
     
     # Count nb of suitable services in the db 
-    query = "SELECT count(*) FROM services WHERE "+where
+    query = count_services_query % where
     
     cur = db.execute_db(conn, query, [], True)
     
@@ -878,46 +1552,199 @@ def main(argv):
     
     if (nb_services!=0): 
         
-        if(nb_ps<=nb_services):
-            
-            # Get suitable services
-            order = "id asc, url asc"
-            # query : get those columns only
-            query = "SELECT id,url,spec,specv,params FROM services WHERE "+where +" ORDER BY "+order
+        # the timings of the validations of this run are stored with its start time, see report.py
+        run = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        logging.info("Storing the timings of the validations for run %s",run)
+        if(timings_keep>0):
+            min_run_s = (datetime.datetime.now()-datetime.timedelta(timings_keep)).strftime('%Y-%m-%d %H:%M:%S')
+            cur = db.execute_db(conn, delete_timings_query, [min_run_s])
+            logging.info("Removed the timings of %d validations of the runs before %s",max(cur.rowcount,0),min_run_s)
         
-            cur = db.execute_db(conn, query, [], True)
-            services = cur.fetchall()   
-            
-            conn.close()    
-            #sys.exit(0)
+        # store of the outputs of the validators
+        store = None
+        if(replay_dir!=None):
+            store = archive.ResponseStore(replay_dir)
+        elif(cache_dir!=None):
+            store = archive.ResponseStore(cache_dir,cache_ttl*3600,int(cache_size*1024*1024))
+            logging.info("Storing the outputs of the validators in %s, reused during %g hours",cache_dir,cache_ttl)
+        
+        # No limits for replay, the validators are not called
+        if(replay_dir!=None):
+            max_per_validator = 0
+            max_per_host = 0
+        scheduler = Scheduler(max_per_validator,max_per_host)
+        
+        conn.close() # no sqlite connection across fork(): the services are read with a new one once the workers are started
+        
+        # The validation is almost only waiting for the validators: with engine thread, many validations run in one process,
+        # each in a thread. Parsing and writing are the same for both engines.
+        if(engine=="thread"):
+            nb_workers = concurrency
+            new_queue = Queue.Queue
+            new_worker = threading.Thread
+            pool = httppool.Pool(pool_size,pool_idle) # shared by the threads
+        else:
+            nb_workers = nb_ps
+            new_queue = multiprocessing.Queue
+            new_worker = multiprocessing.Process
+            pool = (pool_size,pool_idle) # each process creates its own pool
+        if(replay_dir!=None):
+            pool = None # no call to the validators
+        
+        if(nb_workers>nb_services): # no need for more workers than services
+            logging.info("nb_workers>nb_services, using only %d workers",nb_services)
+            nb_workers = nb_services
+        
+        logging.info("Using engine %s with %d workers",engine,nb_workers)
+        
+        # start the writer, the only one writing to the DB
+        results = new_queue()
+        writer_stats = new_queue()
+        writer = new_worker(target=write_results,name="Writer",args=(results,db_file,db_profile,nb_workers,commit_rows,commit_secs,writer_stats,run))
+        writer.start()
+        
+        # start the workers: each one takes the services one by one from its jobs queue until it gets None
+        jobs = []
+        done = new_queue()
+        workers = []
+        for i in range(nb_workers):
+            jobs.append(new_queue())
+            p = new_worker(target=validate_services,name="Worker-%d" % (i+1),args=(i,jobs[i],done,timeout,results,pool,int(max_size*1024*1024),store))
+            workers.append(p)
+            p.start()
+            #p.join()
+        
+        # Get suitable services, sorted by group (see group_services)
+        conn = db.open_db(db_file,db_profile)
+        conn.create_function("normalize_url",1,normalize_url)
+        cur = db.execute_db(conn, services_query % where, [], True)
+        groups = group_services(cur)
+        
+        # The groups are read while the services are validated, as the scheduler needs them: at most max_pending groups wait in
+        # the scheduler. The cursor is open until all are read: with a rollback journal, it would prevent the writer from
+        # committing, so all the groups are read first
+        if(db.execute_db(conn, "PRAGMA journal_mode", [], True).fetchone()[0].lower()!="wal" and max_pending>0):
+            logging.info("DB not in WAL mode, reading all the services before validating them")
+            max_pending = 0
+        reading = {"nb_groups":0, "nb_services":0, "done":False} # groups read so far, services of the groups scheduled
+        def read_groups():
+            '''
+            add the groups read from the cursor to the scheduler until max_pending groups are pending or all are read.
+            For replay, the groups without stored output are not scheduled
+            '''
+            for group in groups:
+                reading["nb_groups"] += 1
+                if(replay_dir!=None and not store.has(validator_url(group[2],group[3],group[4],group[1],timeout))):
+                    continue
+                scheduler.add(group)
+                reading["nb_services"] += len(group[5])
+                if(max_pending>0 and scheduler.nb_pending>=max_pending):
+                    return
+            reading["done"] = True
+            cur.close()
+            conn.close()
+            logging.info("%d groups of services with same URL, spec and params, %d services to validate",reading["nb_groups"],reading["nb_services"])
         
-            #print(services[0]["id"]) # debug
-            #print(services[0])
-            #sys.exit(0)
+        read_groups()
+        
+        logging.info("%d validations to do %swith %d workers",scheduler.nb_pending,"" if reading["done"] else "(more to read) ",nb_workers)
+        
+        # Dispatch the services in the order given by the scheduler: a service is only put in the jobs queue of a worker when it is free
+        # and the limits per validator and per host allow it
+        free = range(nb_workers-1,-1,-1) # workers waiting for a service
+        running = {} # worker -> service it validates
+        durations = [] # duration of each validation
+        t_start = time.time()
+        while(True):
+            if(not reading["done"] and scheduler.nb_pending<max_pending):
+                read_groups()
             
-            #print(services[0])
+            while(free):
+                service = scheduler.next()
+                if(service==None): # no service can be validated now
+                    break
+                i = free.pop()
+                running[i] = service
+                jobs[i].put(service)
             
-            # Slice the services array into nb_ps arrays of same size
-            sservices = numpy.array_split(services, nb_ps)
+            if(not running): # all services done
+                break
             
+            # wait for a service to be done, checking that the workers and the writer are still alive (a process may be killed,
+            # ex: out of memory): the service of a dead worker is given up and the writer is told not to wait for it
+            try:
+                (i,secs) = done.get(True,check_secs)
+            except Queue.Empty:
+                for i in running.keys():
+                    if(not workers[i].is_alive()):
+                        service = running.pop(i)
+                        logging.error("%s is dead, service ivoid=%s url=%s not validated",workers[i].name,service[0],service[1])
+                        scheduler.done(service)
+                        results.put(("end",i))
+                if(not writer.is_alive()):
+                    logging.error("Writer is dead, the results can not be stored. Aborting.")
+                    for q in jobs: # the threads stop after their current service, sys.exit() waits for them
+                        q.put(None)
+                    for p in workers:
+                        if(engine=="process"):
+                            p.terminate()
+                    sys.exit(1)
+                continue
+            if(i in running): # else already given up
+                scheduler.done(running.pop(i))
+                durations.append(secs)
+                free.append(i)
+        if(scheduler.nb_pending>0):
+            logging.error("No worker alive, %d validations not done",scheduler.nb_pending)
+        if(not reading["done"]):
+            logging.error("No worker alive, services not all read")
+            cur.close()
+            conn.close()
+        nb_services = reading["nb_services"] # for the stats: the services skipped are not counted
         
-            for i in range(len(sservices)):
-                logging.info("Slice # %d len=%d first ivoid=%s",i,len(sservices[i]),(sservices[i][0][0]))
+        # one None per worker to tell them there is no more service
+        for q in jobs:
+            q.put(None)
         
+        # wait for the workers then for the writer to store their last results
+        for p in workers:
+            p.join()
+        while(True):
+            try:
+                stats = writer_stats.get(True,check_secs)
+                break
+            except Queue.Empty:
+                if(not writer.is_alive()):
+                    logging.error("Writer is dead, its last results may not be stored. Aborting.")
+                    sys.exit(1)
+        writer.join()
+        writer_query_stats = stats.pop("query_stats")
+        if(engine=="process"): # else the writer thread has the same db.query_stats
+            db.merge_query_stats(writer_query_stats)
+        logging.info("All workers and writer finished")
         
-            #sys.exit(0)
-            
-            
-            jobs = []
-            for i in range(nb_ps):
-                p = multiprocessing.Process(target=validate_services,args=(sservices[i],timeout,db_file))
-                jobs.append(p)
-                p.start()
-                #p.join()
-                
-        else:
-            logging.error("nb_ps>nb_services. Try with a lower nb_ps")
-            sys.exit(1)
+        elapsed = time.time()-t_start
+        stats.update({
+             "engine"               : engine
+            ,"nb_workers"           : nb_workers
+            ,"nb_services"          : nb_services
+            ,"nb_validations"       : len(durations)
+            ,"elapsed_secs"         : elapsed
+            ,"services_per_sec"     : nb_services/elapsed if elapsed>0 else 0
+            ,"latency_p50_secs"     : percentile(durations,50)
+            ,"latency_p99_secs"     : percentile(durations,99)
+        })
+        logging.info("%d services (%d validations) in %.1f secs: %.1f services/s, latency p50=%.3f p99=%.3f secs, DB time %.1f secs",
+                     nb_services,len(durations),elapsed,stats["services_per_sec"],stats["latency_p50_secs"],stats["latency_p99_secs"],stats["db_secs"])
+        if(stats_file!=None):
+            with open(stats_file,"w") as f:
+                json.dump(stats,f,indent=1,sort_keys=True)
+        db.log_query_stats()
+        if(engine=="thread" and pool!=None):
+            pool.log_stats()
+            pool.close()
+        if(cache_dir!=None and replay_dir==None):
+            store.evict()
             
     else: 
         logging.error("No suitable service found. Aborting.")